@@ -7,6 +7,8 @@ from dotenv import load_dotenv
 import logging
 from zoneinfo import ZoneInfo
 
+from .sqlite_profile import configure_sqlite, pragmas_from_env
+
 try:
     from apscheduler.schedulers.background import BackgroundScheduler
     from apscheduler.triggers.cron import CronTrigger
@@ -36,9 +38,9 @@ def update_weekly_reminder_schedule(app):
     """Configure the weekly reminder job based on current settings."""
     if scheduler is None:
         return
-    from .models import EmailSettings  # Local import to avoid circular dependency
+    from .settings_cache import get_email_settings  # Local import to avoid circular dependency
     with app.app_context():
-        settings = EmailSettings.query.first()
+        settings = get_email_settings()
         if settings and settings.weekly_reminder_time:
             hour = settings.weekly_reminder_time.hour
             minute = settings.weekly_reminder_time.minute
@@ -59,10 +61,69 @@ def update_weekly_reminder_schedule(app):
 
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
+    # Signs sessions, pass QR codes and CSRF tokens, so a known key would let
+    # anyone forge them; there is deliberately no default.
+    secret_key = os.getenv('SECRET_KEY')
+    if not secret_key:
+        raise RuntimeError(
+            'SECRET_KEY is not set. Set it in the environment or in .env, '
+            'e.g. to the output of: python -c "import secrets; print(secrets.token_hex(32))"'
+        )
     app.config.from_mapping(
-        SECRET_KEY='devkey',
-        SQLALCHEMY_DATABASE_URI='sqlite:///../instance/passes.db',
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SECRET_KEY=secret_key,
+        SQLALCHEMY_DATABASE_URI=os.getenv('DATABASE_URL', 'sqlite:///../instance/passes.db'),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Pragmas run on every new SQLite connection (WAL, busy timeout, ...),
+        # see ``app.sqlite_profile``.
+        SQLITE_PRAGMAS=pragmas_from_env(),
+        # Number of background threads delivering queued emails. Set to 0 to
+        # only enqueue (e.g. in one-off scripts) and let another process send.
+        OUTBOX_WORKERS=int(os.getenv('OUTBOX_WORKERS', '2')),
+        OUTBOX_POLL_INTERVAL=float(os.getenv('OUTBOX_POLL_INTERVAL', '5')),
+        # Days sent emails are kept in the outbox (0 = keep forever).
+        OUTBOX_RETENTION_DAYS=float(os.getenv('OUTBOX_RETENTION_DAYS', '30')),
+        # Seconds a cached EmailSettings snapshot is trusted before it is
+        # reloaded; bounds how long other workers see outdated settings.
+        EMAIL_SETTINGS_TTL=float(os.getenv('EMAIL_SETTINGS_TTL', '30')),
+        # Weekly reminders are sent in batches of REMINDER_BATCH_SIZE
+        # recipients per SMTP session by REMINDER_SENDERS parallel senders,
+        # limited to REMINDER_RATE_LIMIT messages per second (0 = no limit).
+        REMINDER_BATCH_SIZE=int(os.getenv('REMINDER_BATCH_SIZE', '50')),
+        REMINDER_SENDERS=int(os.getenv('REMINDER_SENDERS', '2')),
+        REMINDER_RATE_LIMIT=float(os.getenv('REMINDER_RATE_LIMIT', '10')),
+        REMINDER_LEASE_SECONDS=int(os.getenv('REMINDER_LEASE_SECONDS', '300')),
+        # Compressed snapshots written every BACKUP_INTERVAL_HOURS hours
+        # (0 = disabled) to BACKUP_DIR, keeping the newest BACKUP_RETENTION.
+        BACKUP_INTERVAL_HOURS=float(os.getenv('BACKUP_INTERVAL_HOURS', '0')),
+        BACKUP_RETENTION=int(os.getenv('BACKUP_RETENTION', '14')),
+        # Threads hashing passwords of a CSV member import (0 = one per
+        # CPU), see ``app.member_import``.
+        IMPORT_HASH_WORKERS=int(os.getenv('IMPORT_HASH_WORKERS', '0')),
+        # Occurrences of recurring event series are created this many days
+        # ahead, see ``app.event_series``.
+        SERIES_HORIZON_DAYS=int(os.getenv('SERIES_HORIZON_DAYS', '28')),
+        # Live seat availability streams, off by default because every open
+        # stream holds a worker thread; enable them only with an async or
+        # threaded gunicorn worker, see ``app.live_seats``.  Seconds between
+        # checks for changes made by other workers, between keep-alive
+        # comments and before a stream ends and the browser reconnects.
+        SSE_ENABLED=bool(int(os.getenv('SSE_ENABLED', '0'))),
+        SSE_POLL_INTERVAL=float(os.getenv('SSE_POLL_INTERVAL', '1')),
+        SSE_KEEPALIVE=float(os.getenv('SSE_KEEPALIVE', '15')),
+        SSE_MAX_AGE=float(os.getenv('SSE_MAX_AGE', '300')),
+    )
+    app.config['BACKUP_DIR'] = os.getenv(
+        'BACKUP_DIR', os.path.join(app.instance_path, 'backups')
+    )
+    # Rendered PDF reports and the TrueType font used for them, see
+    # ``app.reports``.
+    app.config['REPORT_DIR'] = os.getenv(
+        'REPORT_DIR', os.path.join(app.instance_path, 'reports')
+    )
+    app.config['REPORT_FONT'] = os.getenv('REPORT_FONT')
+    # Rendered pass QR codes, see ``app.pass_codes``.
+    app.config['QR_CACHE_DIR'] = os.getenv(
+        'QR_CACHE_DIR', os.path.join(app.instance_path, 'qr_cache')
     )
 
     db.init_app(app)
@@ -82,132 +143,62 @@ def create_app():
 
     # Ensure the database and required tables exist. Without this, a new
     # deployment would raise ``OperationalError`` when a route queries a
-    # table that hasn't been created yet, resulting in a 500 error.
-    #
-    # ``db.create_all()`` only creates tables that do not already exist and
-    # does not add new columns to existing tables. The application recently
-    # introduced a ``color`` column on the ``Event`` model which older
-    # databases may lack. Attempting to query such a database causes a
-    # ``sqlite3.OperationalError: no such column: event.color`` and results in
-    # a 500 error when the calendar page is opened.  To provide a smooth
-    # upgrade path without requiring a manual migration step, check for the
-    # column and add it if missing.
+    # table that hasn't been created yet, resulting in a 500 error. Schema
+    # changes are applied as numbered migrations, so an up-to-date database
+    # only costs a single version lookup here, see ``app.migrations``.
+    from .migrations import upgrade  # Local import to avoid circular dependency
+    from .backup import database_path  # Local import to avoid circular dependency
+    from .restore import watch_database_file  # Local import to avoid circular dependency
+    from .schedule import grid_cache, participants_cache  # Local import to avoid circular dependency
+    from .calendar_feed import feed_cache  # Local import to avoid circular dependency
+    from .settings_cache import invalidate_email_settings  # Local import to avoid circular dependency
     with app.app_context():
-        db.create_all()
-
-        # ``PRAGMA table_info`` returns the columns of the given table.  When
-        # the ``color`` column is absent, execute an ``ALTER TABLE`` statement
-        # to add it with the default value ``'blue'`` so existing rows remain
-        # valid and future queries succeed.
-        # SQLAlchemy 2 removed the ``Engine.execute`` helper.  Use an explicit
-        # connection so this code works on newer versions while remaining
-        # compatible with SQLAlchemy 1.x.
-        from sqlalchemy import text
-
-        with db.engine.connect() as conn:
-            insp = conn.execute(text("PRAGMA table_info(event)"))
-            columns = [row[1] for row in insp]
-            if 'color' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE event ADD COLUMN color VARCHAR(20) DEFAULT 'blue'"
-                    )
-                )
-                conn.commit()
-            insp.close()
-
-            # Ensure weekly_reminder_opt_in exists on the user table
-            insp = conn.execute(text("PRAGMA table_info(user)"))
-            columns = [row[1] for row in insp]
-            if 'weekly_reminder_opt_in' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE user ADD COLUMN weekly_reminder_opt_in BOOLEAN DEFAULT 0"
-                    )
-                )
-                conn.commit()
-            insp.close()
-
-            insp = conn.execute(text("PRAGMA table_info(email_settings)"))
-            columns = [row[1] for row in insp]
-            if 'event_signup_user_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_user_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_signup_user_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_user_text TEXT"
-                    )
-                )
-            if 'event_signup_admin_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_admin_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_signup_admin_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_admin_text TEXT"
-                    )
-                )
-            if 'event_unregister_user_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_user_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_unregister_user_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_user_text TEXT"
-                    )
-                )
-            if 'event_unregister_admin_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_admin_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_unregister_admin_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_admin_text TEXT"
-                    )
-                )
-            if 'weekly_reminder_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN weekly_reminder_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'weekly_reminder_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN weekly_reminder_text TEXT"
-                    )
-                )
-            if 'weekly_reminder_day' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN weekly_reminder_day INTEGER DEFAULT 0"
-                    )
-                )
-            if 'weekly_reminder_time' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN weekly_reminder_time TIME"
-                    )
-                )
-            conn.commit()
-            insp.close()
+        configure_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
+        db_path = database_path(db.engine)
+        if db_path:
+            # Drop pooled connections and cached data after a restore made
+            # by any worker, see ``app.restore``.
+            watch_database_file(
+                db.engine,
+                db_path,
+                on_swap=(
+                    invalidate_email_settings,
+                    grid_cache.clear,
+                    participants_cache.clear,
+                    feed_cache.clear,
+                ),
+            )
+        upgrade(db.engine, db.metadata)
 
     # Set up weekly reminder scheduler if APScheduler is available
     if scheduler:
         update_weekly_reminder_schedule(app)
+        if app.config['BACKUP_INTERVAL_HOURS'] > 0:
+            from .backup import write_scheduled_backup  # Local import to avoid circular dependency
+            scheduler.add_job(
+                write_scheduled_backup,
+                'interval',
+                hours=app.config['BACKUP_INTERVAL_HOURS'],
+                args=[app],
+                id='database_backup',
+                replace_existing=True,
+            )
+        from .event_series import materialize_scheduled  # Local import to avoid circular dependency
+        scheduler.add_job(
+            materialize_scheduled,
+            CronTrigger(hour=0, minute=5),
+            args=[app],
+            id='materialize_series',
+            replace_existing=True,
+        )
         scheduler.start()
 
+    # Deliver queued notification emails in the background
+    from .mailer import start_outbox_workers  # Local import to avoid circular dependency
+    start_outbox_workers(app)
+
+    # Publisher of live seat availability for ``/events/stream``
+    from .live_seats import init_seat_publisher  # Local import to avoid circular dependency
+    init_seat_publisher(app)
+
     return app
@@ -0,0 +1,148 @@
+"""Consistent online backups of the SQLite database.
+
+Copying ``passes.db`` while requests are writing can produce a torn file.
+:func:`snapshot` uses SQLite's online backup API instead: pages are copied
+in small batches with a short pause between them, so writers are never
+blocked for long and the copy is a consistent image of the database.
+Snapshots are gzip-compressed, either streamed to the admin who asked for
+a download (:func:`stream_backup`) or written to ``BACKUP_DIR`` on a
+schedule (:func:`write_scheduled_backup`), keeping the newest
+``BACKUP_RETENTION`` files.
+"""
+
+import glob
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+BACKUP_PREFIX = 'passes-'
+BACKUP_SUFFIX = '.db.gz'
+CHUNK_SIZE = 64 * 1024
+
+
+def database_path(engine):
+    """Return the file behind ``engine`` or ``None`` if it is not a SQLite file."""
+    if engine.url.get_backend_name() != 'sqlite':
+        return None
+    path = engine.url.database
+    if not path or path == ':memory:':
+        return None
+    return os.path.abspath(path)
+
+
+def snapshot(source_path, target_path, pages=256, pause=0.005):
+    """Copy ``source_path`` to ``target_path`` with the online backup API.
+
+    ``pages`` pages are copied per step and the source is released for
+    ``pause`` seconds in between so writers can proceed.
+    """
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        with target:
+            source.backup(target, pages=pages, sleep=pause)
+    finally:
+        target.close()
+        source.close()
+
+
+def _gzip_chunks(path, chunk_size=CHUNK_SIZE):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as fh:
+        while True:
+            data = fh.read(chunk_size)
+            if not data:
+                break
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def stream_backup(source_path, pages=256):
+    """Snapshot the database and return a generator of gzip chunks.
+
+    The snapshot is taken before the generator is returned so errors are
+    raised to the caller; its temporary file is removed once the stream
+    is exhausted or closed.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='backup-', suffix='.db', dir=os.path.dirname(source_path)
+    )
+    os.close(fd)
+    try:
+        snapshot(source_path, tmp_path, pages=pages)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    def generate():
+        try:
+            yield from _gzip_chunks(tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    return generate()
+
+
+def list_backups(backup_dir):
+    """Return the scheduled backups in ``backup_dir``, oldest first."""
+    return sorted(glob.glob(os.path.join(backup_dir, BACKUP_PREFIX + '*' + BACKUP_SUFFIX)))
+
+
+def prune_backups(backup_dir, keep):
+    """Delete all but the newest ``keep`` backups."""
+    backups = list_backups(backup_dir)
+    for path in backups[:max(len(backups) - keep, 0)]:
+        os.remove(path)
+
+
+def write_backup(source_path, backup_dir, keep, pages=256):
+    """Write a compressed snapshot to ``backup_dir`` and apply retention.
+
+    The file is renamed into place only when complete, so a crash never
+    leaves a truncated backup that looks valid.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}"
+    path = os.path.join(backup_dir, name)
+    fd, tmp_path = tempfile.mkstemp(prefix='.backup-', dir=backup_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in stream_backup(source_path, pages=pages):
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    prune_backups(backup_dir, keep)
+    return path
+
+
+def write_scheduled_backup(app):
+    """Scheduler job writing a backup unless a recent one already exists.
+
+    Every worker process runs the scheduler; the age check keeps them from
+    each writing a copy for the same interval.
+    """
+    from . import db  # Local import to avoid circular dependency
+
+    with app.app_context():
+        source_path = database_path(db.engine)
+    if not source_path:
+        return None
+    backup_dir = app.config['BACKUP_DIR']
+    interval = app.config['BACKUP_INTERVAL_HOURS'] * 3600
+    backups = list_backups(backup_dir)
+    if backups and time.time() - os.path.getmtime(backups[-1]) < interval / 2:
+        return None
+    try:
+        return write_backup(source_path, backup_dir, app.config['BACKUP_RETENTION'])
+    except Exception:
+        logging.exception('Scheduled database backup failed')
+        return None
@@ -0,0 +1,184 @@
+"""iCalendar feeds of the schedule.
+
+Every member has a personal feed of the events they signed up for, at a URL
+containing the random ``User.calendar_token`` (looked up by a unique index,
+and replaced to revoke a leaked link), and there is a public feed of the
+whole schedule.  Calendar apps poll feeds every few minutes, so a poll
+should cost a single indexed query.  The personal feed is versioned by the
+member's registrations in the window (count and sum of the registration
+ids, plus the newest ``Event.version`` among the events), the public feed
+by the schedule version.  The version is the feed's ETag: a matching
+``If-None-Match`` (or ``If-Modified-Since``) is answered with 304 before
+anything is rendered, and rendered feeds are kept in a process-local cache
+keyed by the version.  Both versions can go back when a backup is restored,
+so the ETags also carry the restore generation and the cache is cleared on
+a restore.
+"""
+
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from flask import Response, request
+from sqlalchemy import func, select
+
+from .models import Event, EventRegistration, User, db, new_calendar_token
+from .restore import generation_tag
+from .schedule import FragmentCache, current_schedule_version
+
+# Events are stored in local time, like the scheduler's time zone.
+LOCAL_TZ = ZoneInfo('Europe/Budapest')
+PAST_DAYS = 30
+PUBLIC_DAYS = 60
+
+feed_cache = FragmentCache(maxsize=256)
+
+
+def feed_token(user):
+    """Return the token of the personal feed of ``user``."""
+    return user.calendar_token
+
+
+def feed_user(token):
+    """Return the member owning a feed token, else ``None``."""
+    return db.session.execute(select(User).where(User.calendar_token == token)).scalar()
+
+
+def reset_feed_token(user):
+    """Give ``user`` a new feed token, revoking the old URL, and commit."""
+    user.calendar_token = new_calendar_token()
+    db.session.commit()
+
+
+def _window_start():
+    start = datetime.now().date() - timedelta(days=PAST_DAYS)
+    return datetime.combine(start, datetime.min.time())
+
+
+def user_feed_etag(user_id, start):
+    count, id_sum, version = db.session.execute(
+        select(
+            func.count(EventRegistration.id),
+            func.coalesce(func.sum(EventRegistration.id), 0),
+            func.coalesce(func.max(Event.version), 0),
+        )
+        .join(Event, Event.id == EventRegistration.event_id)
+        .where(EventRegistration.user_id == user_id, Event.start_time >= start)
+    ).one()
+    return f'{generation_tag()}u{user_id}-{start:%Y%m%d}-{count}-{id_sum}-{version}'
+
+
+def public_feed_etag(start):
+    version = current_schedule_version()
+    return f'{generation_tag()}s-{start:%Y%m%d}-{version}'
+
+
+def _user_events(user_id, start):
+    return db.session.execute(
+        select(Event)
+        .join(EventRegistration, EventRegistration.event_id == Event.id)
+        .where(EventRegistration.user_id == user_id, Event.start_time >= start)
+        .order_by(Event.start_time)
+    ).scalars().all()
+
+
+def _public_events(start):
+    return db.session.execute(
+        select(Event)
+        .where(
+            Event.start_time >= start,
+            Event.start_time < start + timedelta(days=PAST_DAYS + PUBLIC_DAYS),
+        )
+        .order_by(Event.start_time)
+    ).scalars().all()
+
+
+def _escape(text):
+    return (
+        text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    # Lines are limited to 75 octets; continuation lines start with a space.
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    parts, current = [], b''
+    for char in line:
+        encoded = char.encode('utf-8')
+        if len(current) + len(encoded) > (75 if not parts else 74):
+            parts.append(current.decode('utf-8'))
+            current = b''
+        current += encoded
+    parts.append(current.decode('utf-8'))
+    return '\r\n '.join(parts)
+
+
+def _utc(value):
+    return value.replace(tzinfo=LOCAL_TZ).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_ics(events, name, host, with_spots=False):
+    """Return the iCalendar text of ``events``."""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Bérletkezelő//Órarend//HU',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(name)}',
+        'X-PUBLISHED-TTL:PT15M',
+    ]
+    for e in events:
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:event-{e.id}@{host}',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{_utc(e.start_time)}',
+            f'DTEND:{_utc(e.end_time)}',
+            f'SUMMARY:{_escape(e.name)}',
+        ]
+        if with_spots:
+            lines.append(f'DESCRIPTION:Szabad hely: {e.spots_left} / {e.capacity}')
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+
+
+def _feed_response(etag, build):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    cached = feed_cache.get(etag)
+    if cached is None:
+        modified = datetime.now(timezone.utc).replace(microsecond=0)
+        cached = (build(), modified)
+        feed_cache.set(etag, cached)
+    body, modified = cached
+    response = Response(body, mimetype='text/calendar')
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def user_feed(user):
+    """Return the response for the personal feed of ``user``."""
+    start = _window_start()
+    return _feed_response(
+        user_feed_etag(user.id, start),
+        lambda: render_ics(
+            _user_events(user.id, start), f'Foglalásaim – {user.username}', request.host
+        ),
+    )
+
+
+def public_feed():
+    """Return the response for the public schedule feed."""
+    start = _window_start()
+    return _feed_response(
+        public_feed_etag(start),
+        lambda: render_ics(_public_events(start), 'Órarend', request.host, with_spots=True),
+    )
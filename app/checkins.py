@@ -0,0 +1,160 @@
+"""Race-free pass check-ins.
+
+A use is recorded with a single conditional ``UPDATE`` which only succeeds
+while the pass is valid and has uses left, and the ``PassUsage`` row is
+inserted in the same transaction, so concurrent scanners can never overdraw
+a pass.  Clients may send an idempotency key with each check-in; it is
+stored on the ``PassUsage`` row under a unique index, so a retried or
+double-submitted request is answered with the original result instead of
+counting twice.  Keys are unique across passes: a key already used for
+another pass is rejected.  :func:`check_in_event` checks in a whole event
+roster in one statement, keyed per event and member so it can be repeated
+safely.
+"""
+
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import String, and_, cast, exists, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import EventRegistration, Pass, PassUsage, db
+
+CHECKED_IN = 'checked_in'
+REPLAYED = 'replayed'
+EXHAUSTED = 'exhausted'
+EXPIRED = 'expired'
+NOT_FOUND = 'not_found'
+KEY_CONFLICT = 'key_conflict'
+
+
+def _replay(idempotency_key):
+    return db.session.execute(
+        select(PassUsage.pass_id).where(PassUsage.idempotency_key == idempotency_key)
+    ).scalar()
+
+
+def _replayed(replayed_pass_id, pass_id):
+    status = REPLAYED if replayed_pass_id == pass_id else KEY_CONFLICT
+    return status, db.session.get(Pass, pass_id)
+
+
+def check_in(pass_id, idempotency_key=None):
+    """Record one use of ``pass_id`` and commit.
+
+    Returns ``(status, pass)`` where ``status`` is :data:`CHECKED_IN`,
+    :data:`REPLAYED` (``idempotency_key`` was already used for this pass;
+    nothing is counted), :data:`KEY_CONFLICT` (it was used for another
+    pass; nothing is counted), :data:`EXHAUSTED`, :data:`EXPIRED` or
+    :data:`NOT_FOUND`.  ``pass`` is the up-to-date ``Pass`` of ``pass_id``
+    or ``None`` if it does not exist.
+    """
+    if idempotency_key:
+        replayed = _replay(idempotency_key)
+        if replayed is not None:
+            return _replayed(replayed, pass_id)
+    used = db.session.execute(
+        update(Pass)
+        .where(
+            Pass.id == pass_id,
+            Pass.used < Pass.total_uses,
+            Pass.end_date >= date.today(),
+        )
+        .values(used=Pass.used + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not used:
+        db.session.rollback()
+        p = db.session.get(Pass, pass_id)
+        if p is None:
+            return NOT_FOUND, None
+        return (EXPIRED if p.end_date < date.today() else EXHAUSTED), p
+    try:
+        db.session.execute(
+            insert(PassUsage).values(pass_id=pass_id, idempotency_key=idempotency_key or None)
+        )
+    except IntegrityError:
+        # A concurrent request with the same key won the race.
+        db.session.rollback()
+        return _replayed(_replay(idempotency_key), pass_id)
+    db.session.commit()
+    p = db.session.get(Pass, pass_id, populate_existing=True)
+    return CHECKED_IN, p
+
+
+EventCheckIn = namedtuple('EventCheckIn', 'checked_in already no_pass')
+
+
+def _event_key(event_id):
+    return f'event:{event_id}:user:'
+
+
+def check_in_event(event_id, today=None):
+    """Use one pass of every member registered for ``event_id`` and commit.
+
+    Each member's valid pass expiring first is resolved and charged by a
+    single ``UPDATE ... RETURNING``, all usages are inserted with one
+    ``executemany`` in the same transaction.  Members already checked in
+    for this event are skipped, so repeating the call is harmless.
+    Returns an ``EventCheckIn`` of the charged ``(pass_id, user_id)``
+    pairs, the number of members already checked in and the ids of the
+    members without a usable pass.
+    """
+    today = today or date.today()
+    prefix = _event_key(event_id)
+    member_key = literal(prefix) + cast(Pass.user_id, String)
+    candidates = (
+        select(
+            Pass.id,
+            func.row_number()
+            .over(partition_by=Pass.user_id, order_by=(Pass.end_date, Pass.id))
+            .label('rank'),
+        )
+        .join(
+            EventRegistration,
+            and_(
+                EventRegistration.user_id == Pass.user_id,
+                EventRegistration.event_id == event_id,
+            ),
+        )
+        .where(
+            Pass.used < Pass.total_uses,
+            Pass.end_date >= today,
+            ~exists().where(PassUsage.idempotency_key == member_key),
+        )
+        .subquery()
+    )
+    charged = db.session.execute(
+        update(Pass)
+        .where(Pass.id.in_(select(candidates.c.id).where(candidates.c.rank == 1)))
+        .values(used=Pass.used + 1)
+        .returning(Pass.id, Pass.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if charged:
+        db.session.execute(
+            insert(PassUsage),
+            [
+                {'pass_id': pass_id, 'idempotency_key': f'{prefix}{user_id}'}
+                for pass_id, user_id in charged
+            ],
+        )
+    db.session.commit()
+
+    roster = db.session.execute(
+        select(
+            EventRegistration.user_id,
+            exists()
+            .where(
+                PassUsage.idempotency_key
+                == literal(prefix) + cast(EventRegistration.user_id, String)
+            )
+            .label('done'),
+        ).where(EventRegistration.event_id == event_id)
+    ).all()
+    charged_users = {user_id for _, user_id in charged}
+    return EventCheckIn(
+        checked_in=[tuple(row) for row in charged],
+        already=sum(1 for user_id, done in roster if done and user_id not in charged_users),
+        no_pass=sorted(user_id for user_id, done in roster if not done),
+    )
@@ -1,10 +1,11 @@
-def base_email_template(title: str, content: str) -> str:
-    return f"""
+_BASE_HEAD = """
     <html>
       <body style='font-family: Arial, sans-serif; background-color: #f5f5f5; padding: 20px;'>
         <div style='max-width: 600px; margin: auto; background: white; padding: 30px; border-radius: 8px;'>
-          <h2 style='color: #2c3e50;'>{title}</h2>
-          <p style='color: #333;'>{content}</p>
+          <h2 style='color: #2c3e50;'>"""
+_BASE_MIDDLE = """</h2>
+          <p style='color: #333;'>"""
+_BASE_TAIL = """</p>
           <hr>
           <small style='color: #999;'>Ez egy automatikus üzenet a Bérletkezelő Rendszertől.</small>
         </div>
@@ -12,9 +13,16 @@ def base_email_template(title: str, content: str) -> str:
     </html>
     """
 
+
+def base_email_template(title: str, content: str) -> str:
+    return f"{_BASE_HEAD}{title}{_BASE_MIDDLE}{content}{_BASE_TAIL}"
+
+def registration_content(username: str, password: str) -> str:
+    return f"Kedves {username},<br><br>Felhasználónév: {username}<br>Jelszó: {password}<br>"
+
+
 def registration_email(username: str, password: str) -> str:
-    content = f"Kedves {username},<br><br>Felhasználónév: {username}<br>Jelszó: {password}<br>"
-    return base_email_template("Fiók létrehozva", content)
+    return base_email_template("Fiók létrehozva", registration_content(username, password))
 
 
 def forgot_password_email(username: str, password: str) -> str:
@@ -38,33 +46,48 @@ def pass_created_email(p) -> str:
     """Return the email HTML for a newly created pass."""
     return base_email_template("Új bérlet létrehozva", _pass_details(p))
 
+
+def pass_deleted_content(username: str, pass_type: str, start, end, used) -> str:
+    return f"Törölt bérlet: {pass_type}<br>{start} - {end}<br>Felhasználva: {used} alkalom"
+
+
 def pass_deleted_email(username: str, pass_type: str, start, end, used) -> str:
-    content = f"Törölt bérlet: {pass_type}<br>{start} - {end}<br>Felhasználva: {used} alkalom"
+    content = pass_deleted_content(username, pass_type, start, end, used)
     return base_email_template("Bérlet törölve", content)
 
 
-def pass_used_email(p) -> str:
-    """Return the email HTML when a pass usage changes."""
+def pass_used_content(p) -> str:
     remaining = p.total_uses - p.used
-    content = (
+    return (
         f"Kedves {p.user.username},<br>"
         f"Felhasználtál egy alkalmat a(z) {p.type} bérletedből.<br>"
         f"Hátralévő alkalmak: {remaining}.<br><br>"
         f"{_pass_details(p)}"
     )
-    return base_email_template("Bérlet használat", content)
 
 
-def pass_usage_reverted_email(p) -> str:
-    """Return the email HTML when a pass usage is undone."""
+def pass_used_email(p) -> str:
+    """Return the email HTML when a pass usage changes."""
+    return base_email_template("Bérlet használat", pass_used_content(p))
+
+
+def pass_usage_reverted_content(p) -> str:
     remaining = p.total_uses - p.used
-    content = (
+    return (
         f"Kedves {p.user.username},<br>"
         f"Visszakaptál egy alkalmat a(z) {p.type} bérletedbe.<br>"
         f"Hátralévő alkalmak: {remaining}.<br><br>"
         f"{_pass_details(p)}"
     )
-    return base_email_template("Bérlethasználat visszavonva", content)
+
+
+def pass_usage_reverted_email(p) -> str:
+    """Return the email HTML when a pass usage is undone."""
+    return base_email_template("Bérlethasználat visszavonva", pass_usage_reverted_content(p))
+
+
+def user_deleted_content(username: str) -> str:
+    return f"{username} törölve."
 
 
 def _event_details(e) -> str:
@@ -75,39 +98,165 @@ def _event_details(e) -> str:
     )
 
 
-def event_signup_user_email(username: str, e) -> str:
-    content = (
+def event_signup_user_content(username: str, e) -> str:
+    return (
         f"Kedves {username},<br><br>"
         f"Sikeresen jelentkeztél a következő eseményre:<br>"
         f"{_event_details(e)}"
     )
-    return base_email_template("Esemény jelentkezés", content)
 
 
-def event_signup_admin_email(username: str, e) -> str:
-    content = (
+def event_signup_user_email(username: str, e) -> str:
+    return base_email_template("Esemény jelentkezés", event_signup_user_content(username, e))
+
+
+def event_signup_admin_content(username: str, e) -> str:
+    return (
         f"Kedves {username},<br><br>"
         f"Az admin regisztrált a következő eseményre:<br>"
         f"{_event_details(e)}"
     )
-    return base_email_template("Esemény jelentkezés", content)
 
 
-def event_unregister_user_email(username: str, e) -> str:
-    """Return the email HTML when a user unregisters from an event."""
-    content = (
+def event_signup_admin_email(username: str, e) -> str:
+    return base_email_template("Esemény jelentkezés", event_signup_admin_content(username, e))
+
+
+def event_unregister_user_content(username: str, e) -> str:
+    return (
         f"Kedves {username},<br><br>"
         f"Sikeresen leiratkoztál a következő eseményről:<br>"
         f"{_event_details(e)}"
     )
-    return base_email_template("Esemény leiratkozás", content)
 
 
-def event_unregister_admin_email(username: str, e) -> str:
-    """Return the email HTML when an admin removes a user from an event."""
-    content = (
+def event_unregister_user_email(username: str, e) -> str:
+    """Return the email HTML when a user unregisters from an event."""
+    return base_email_template("Esemény leiratkozás", event_unregister_user_content(username, e))
+
+
+def event_unregister_admin_content(username: str, e) -> str:
+    return (
         f"Kedves {username},<br><br>"
         f"Az admin törölte a jelentkezésed a következő eseményről:<br>"
         f"{_event_details(e)}"
     )
-    return base_email_template("Esemény leiratkozás", content)
+
+
+def event_unregister_admin_email(username: str, e) -> str:
+    """Return the email HTML when an admin removes a user from an event."""
+    return base_email_template("Esemény leiratkozás", event_unregister_admin_content(username, e))
+
+
+class EmailTemplate:
+    """Notification email registered under an event name.
+
+    ``body`` is a callable returning the HTML content shown inside the base
+    layout.  ``setting`` names the ``EmailSettings`` columns
+    (``<setting>_enabled``/``<setting>_text``) controlling the template and
+    defaults to the template name.
+    """
+
+    __slots__ = ('name', 'subject', 'title', 'body', 'setting')
+
+    def __init__(self, name, subject, title, body, setting=None):
+        self.name = name
+        self.subject = subject
+        self.title = title
+        self.body = body
+        self.setting = setting or name
+
+    def compile(self, settings):
+        """Return a :class:`CompiledEmailTemplate` for the given settings.
+
+        Without a settings row every notification is sent with its default
+        text.  A custom text is shown above the default content, under the
+        subject as heading.
+        """
+        if settings is None:
+            return CompiledEmailTemplate(self, True, _BASE_HEAD + self.title + _BASE_MIDDLE)
+        enabled = bool(getattr(settings, f"{self.setting}_enabled"))
+        custom_text = getattr(settings, f"{self.setting}_text")
+        if custom_text:
+            head = f"{_BASE_HEAD}{self.subject}{_BASE_MIDDLE}{custom_text}<br><br>"
+        else:
+            head = _BASE_HEAD + self.title + _BASE_MIDDLE
+        return CompiledEmailTemplate(self, enabled, head)
+
+
+class CompiledEmailTemplate:
+    """An :class:`EmailTemplate` with its static HTML prefix pre-rendered."""
+
+    __slots__ = ('template', 'subject', 'enabled', 'head')
+
+    def __init__(self, template, enabled, head):
+        self.template = template
+        self.subject = template.subject
+        self.enabled = enabled
+        self.head = head
+
+    def render(self, **context) -> str:
+        return self.head + self.template.body(**context) + _BASE_TAIL
+
+
+EMAIL_TEMPLATES = {}
+
+
+def register_template(template: EmailTemplate) -> EmailTemplate:
+    EMAIL_TEMPLATES[template.name] = template
+    return template
+
+
+register_template(EmailTemplate(
+    'user_created', "Felhasználó létrehozva", "Fiók létrehozva", registration_content
+))
+register_template(EmailTemplate(
+    'user_deleted', "Felhasználó törölve", "Felhasználó törölve", user_deleted_content
+))
+register_template(EmailTemplate(
+    'pass_created', "Új bérlet", "Új bérlet létrehozva", _pass_details
+))
+register_template(EmailTemplate(
+    'pass_deleted', "Bérlet törölve", "Bérlet törölve", pass_deleted_content
+))
+register_template(EmailTemplate(
+    'pass_used', "Bérlet használat", "Bérlet használat", pass_used_content
+))
+register_template(EmailTemplate(
+    'pass_usage_reverted',
+    "Bérlet használat visszavonva",
+    "Bérlethasználat visszavonva",
+    pass_usage_reverted_content,
+    setting='pass_used',
+))
+register_template(EmailTemplate(
+    'event_signup_user', "Esemény jelentkezés", "Esemény jelentkezés", event_signup_user_content
+))
+register_template(EmailTemplate(
+    'event_signup_admin', "Esemény jelentkezés", "Esemény jelentkezés", event_signup_admin_content
+))
+register_template(EmailTemplate(
+    'event_unregister_user', "Esemény leiratkozás", "Esemény leiratkozás",
+    event_unregister_user_content,
+))
+register_template(EmailTemplate(
+    'event_unregister_admin', "Esemény leiratkozás", "Esemény leiratkozás",
+    event_unregister_admin_content,
+))
+
+_compiled = (None, {})
+
+
+def compiled_templates(settings) -> dict:
+    """Return every registered template compiled for ``settings``.
+
+    The result is reused until a settings snapshot with different values
+    is passed in, so templates are compiled once per settings change.
+    """
+    global _compiled
+    cached_settings, templates = _compiled
+    if templates and (cached_settings is settings or cached_settings == settings):
+        return templates
+    templates = {name: t.compile(settings) for name, t in EMAIL_TEMPLATES.items()}
+    _compiled = (settings, templates)
+    return templates
@@ -0,0 +1,179 @@
+"""Weekly recurring event series.
+
+A series is stored once in ``EventSeries`` and its occurrences are plain
+``Event`` rows, so signups, check-ins, the calendar cache and the reports
+work on them unchanged.  Occurrences are created up to a rolling horizon
+(``SERIES_HORIZON_DAYS`` from today) by :func:`materialize_series` with one
+batched ``INSERT`` for all series; the member calendar pages call it before
+reading their window, which costs a single indexed ``SELECT`` when nothing
+is missing, and a daily scheduler job keeps the horizon rolling for the
+anonymous public feed, which never writes.  The unique
+``(series_id, start_time)`` index makes two workers materializing at the
+same time harmless.
+
+Series-wide edits and deletes touch the upcoming occurrences with
+set-based statements.  They bypass the ORM unit of work, so they bump the
+schedule version themselves.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, update
+
+from .models import DeletedEvent, Event, EventRegistration, EventSeries, db
+from .schedule import bump_schedule_version
+
+
+def series_horizon(today=None):
+    """Return the last day occurrences are created for."""
+    today = today or date.today()
+    return today + timedelta(days=current_app.config['SERIES_HORIZON_DAYS'])
+
+
+def _days(weekday, first, last):
+    day = first + timedelta(days=(weekday - first.weekday()) % 7)
+    while day <= last:
+        yield day
+        day += timedelta(days=7)
+
+
+def materialize_series(horizon=None):
+    """Create the missing occurrences of every series up to ``horizon``.
+
+    Commits and returns the number of created events.
+    """
+    horizon = horizon or series_horizon()
+    pending = db.session.execute(
+        select(EventSeries).where(
+            EventSeries.materialized_until < horizon,
+            EventSeries.materialized_until < EventSeries.until,
+        )
+    ).scalars().all()
+    if not pending:
+        return 0
+    rows = []
+    for series in pending:
+        last = min(series.until, horizon)
+        for day in _days(series.weekday, series.materialized_until + timedelta(days=1), last):
+            rows.append({
+                'name': series.name,
+                'start_time': datetime.combine(day, series.start_time),
+                'end_time': datetime.combine(day, series.end_time),
+                'capacity': series.capacity,
+                'color': series.color,
+                'series_id': series.id,
+            })
+        series.materialized_until = last
+    if rows:
+        version = bump_schedule_version(db.session.connection())
+        db.session.execute(insert(Event).prefix_with('OR IGNORE').values(version=version), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def materialize_scheduled(app):
+    """Scheduler job creating the occurrences up to the rolling horizon."""
+    with app.app_context():
+        try:
+            materialize_series()
+        except Exception:
+            logging.exception('Creating series occurrences failed')
+
+
+def create_series(name, weekday, start_time, end_time, capacity, color, start_date, until):
+    """Store a new series, create its occurrences and commit."""
+    series = EventSeries(
+        name=name,
+        weekday=weekday,
+        start_time=start_time,
+        end_time=end_time,
+        capacity=capacity,
+        color=color,
+        start_date=start_date,
+        until=until,
+        materialized_until=start_date - timedelta(days=1),
+    )
+    db.session.add(series)
+    db.session.flush()
+    materialize_series()
+    return series
+
+
+def _at(clock):
+    # Same text format SQLAlchemy stores ``DateTime`` values in on SQLite.
+    return func.date(Event.start_time).concat(literal(clock.strftime(' %H:%M:%S.%f')))
+
+
+def _delete_occurrences(series_id, after):
+    """Delete the occurrences starting at or after ``after`` with their rosters."""
+    upcoming = (Event.series_id == series_id, Event.start_time >= after)
+    version = bump_schedule_version(db.session.connection())
+    db.session.execute(
+        insert(DeletedEvent).from_select(
+            ['event_id', 'version'], select(Event.id, literal(version)).where(*upcoming)
+        )
+    )
+    db.session.execute(
+        delete(EventRegistration).where(
+            EventRegistration.event_id.in_(select(Event.id).where(*upcoming))
+        )
+    )
+    return db.session.execute(delete(Event).where(*upcoming)).rowcount
+
+
+def update_series(series, name, start_time, end_time, capacity, color, until, now=None):
+    """Change ``series`` and all of its upcoming occurrences and commit.
+
+    Occurrences that already started keep their data.  Returns the number
+    of changed occurrences.
+    """
+    now = now or datetime.now()
+    series.name = name
+    series.start_time = start_time
+    series.end_time = end_time
+    series.capacity = capacity
+    series.color = color
+    series.until = until
+    if series.materialized_until > until:
+        _delete_occurrences(
+            series.id, max(now, datetime.combine(until + timedelta(days=1), time.min))
+        )
+        series.materialized_until = until
+    version = bump_schedule_version(db.session.connection())
+    changed = db.session.execute(
+        update(Event)
+        .where(Event.series_id == series.id, Event.start_time >= now)
+        .values(
+            name=name,
+            start_time=_at(start_time),
+            end_time=_at(end_time),
+            capacity=capacity,
+            color=color,
+            version=version,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    materialize_series()
+    return changed
+
+
+def delete_series(series, now=None):
+    """Delete ``series`` with its upcoming occurrences and commit.
+
+    Past occurrences are kept as standalone events for the attendance
+    history.  Returns the number of deleted occurrences.
+    """
+    now = now or datetime.now()
+    deleted = _delete_occurrences(series.id, now)
+    db.session.execute(
+        update(Event)
+        .where(Event.series_id == series.id)
+        .values(series_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.delete(series)
+    db.session.commit()
+    return deleted
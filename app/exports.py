@@ -0,0 +1,144 @@
+"""Streaming CSV/JSON exports of the main tables.
+
+Each export is a single ``SELECT`` read through a server-side cursor in
+chunks of ``CHUNK_SIZE`` rows (``yield_per``); every chunk is encoded and
+yielded before the next one is fetched, so memory use does not depend on
+the number of exported rows.  Exports with a date column accept an
+inclusive ``start``/``end`` date range.  Password columns are never
+exported.
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from .models import Event, EventRegistration, Pass, PassUsage, User, db
+
+CHUNK_SIZE = 1000
+FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+
+
+def _users(start, end):
+    # Users have no date column, the range is ignored.
+    return select(
+        User.id, User.username, User.email, User.role, User.weekly_reminder_opt_in
+    ).order_by(User.id)
+
+
+def _passes(start, end):
+    statement = select(
+        Pass.id,
+        Pass.user_id,
+        User.username,
+        Pass.type,
+        Pass.start_date,
+        Pass.end_date,
+        Pass.total_uses,
+        Pass.used,
+        Pass.comment,
+    ).join(User, User.id == Pass.user_id).order_by(Pass.id)
+    if start:
+        statement = statement.where(Pass.start_date >= start)
+    if end:
+        statement = statement.where(Pass.start_date < end)
+    return statement
+
+
+def _usages(start, end):
+    # Ordered like ``ix_pass_usage_used_on`` so the range needs no sort.
+    statement = select(PassUsage.id, PassUsage.pass_id, PassUsage.used_on).order_by(
+        PassUsage.used_on, PassUsage.id
+    )
+    if start:
+        statement = statement.where(PassUsage.used_on >= start)
+    if end:
+        statement = statement.where(PassUsage.used_on < end)
+    return statement
+
+
+def _registrations(start, end):
+    statement = (
+        select(
+            EventRegistration.id,
+            EventRegistration.event_id,
+            Event.name.label('event_name'),
+            Event.start_time,
+            EventRegistration.user_id,
+            User.username,
+        )
+        .join(Event, Event.id == EventRegistration.event_id)
+        .join(User, User.id == EventRegistration.user_id)
+        .order_by(Event.start_time, EventRegistration.id)
+    )
+    if start:
+        statement = statement.where(Event.start_time >= start)
+    if end:
+        statement = statement.where(Event.start_time < end)
+    return statement
+
+
+EXPORTS = {
+    'users': _users,
+    'passes': _passes,
+    'usages': _usages,
+    'registrations': _registrations,
+}
+
+
+def parse_range(start, end):
+    """Return ``(start, end_exclusive)`` dates for ``YYYY-MM-DD`` strings.
+
+    Empty values leave that side open.  Raises ``ValueError`` on bad input.
+    """
+    start = date.fromisoformat(start) if start else None
+    end = date.fromisoformat(end) + timedelta(days=1) if end else None
+    return start, end
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(columns, partitions):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+    for rows in partitions:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        yield buf.getvalue()
+
+
+def _json_chunks(columns, partitions):
+    yield '['
+    separator = ''
+    for rows in partitions:
+        parts = []
+        for row in rows:
+            parts.append(separator + json.dumps(
+                dict(zip(columns, map(_plain, row))), ensure_ascii=False
+            ))
+            separator = ','
+        yield ''.join(parts)
+    yield ']'
+
+
+def export_rows(name, fmt, start=None, end=None):
+    """Return a generator of encoded chunks of export ``name`` in ``fmt``.
+
+    Must be consumed inside an application context (for a streamed
+    response use ``stream_with_context``).
+    """
+    result = db.session.execute(
+        EXPORTS[name](start, end).execution_options(yield_per=CHUNK_SIZE)
+    )
+    columns = list(result.keys())
+    encode = _csv_chunks if fmt == 'csv' else _json_chunks
+    return encode(columns, result.partitions())
@@ -12,13 +12,15 @@ from wtforms import (
     FileField,
 )
 from wtforms.validators import DataRequired, NumberRange
+from wtforms.widgets import HiddenInput
 
 class PassForm(FlaskForm):
     type = StringField('Típus', validators=[DataRequired()])
     start_date = DateField('Kezdő dátum', validators=[DataRequired()])
     end_date = DateField('Lejárati dátum', validators=[DataRequired()])
     total_uses = IntegerField('Alkalmak száma', validators=[DataRequired(), NumberRange(min=1)])
-    user_id = SelectField('Felhasználó', coerce=int, validators=[DataRequired()])
+    # Filled in by the member search picker, see templates/_user_search.html
+    user_id = IntegerField('Felhasználó', widget=HiddenInput(), validators=[DataRequired()])
     comment = TextAreaField('Megjegyzés')
     submit = SubmitField('Bérlet létrehozása')
 
@@ -99,6 +101,23 @@ class RestoreForm(FlaskForm):
     submit = SubmitField('Visszaállítás')
 
 
+class MemberImportForm(FlaskForm):
+    """Form used for uploading a CSV file of new members."""
+    csv_file = FileField('CSV fájl', validators=[DataRequired()])
+    submit = SubmitField('Importálás')
+
+
+EVENT_COLORS = [
+    ('darkgreen', 'Sötétzöld'),
+    ('red', 'Piros'),
+    ('blue', 'Kék'),
+    ('purple', 'Lila'),
+    ('orange', 'Narancs'),
+    ('burgundy', 'Bordó'),
+    ('darkblue', 'Sötétkék'),
+]
+
+
 class EventForm(FlaskForm):
     name = StringField('Esemény neve', validators=[DataRequired()])
     date = DateField('Dátum', validators=[DataRequired()])
@@ -106,17 +125,33 @@ class EventForm(FlaskForm):
     end_time = TimeField('Vég időpont', validators=[DataRequired()])
     capacity = IntegerField('Létszám', validators=[DataRequired(), NumberRange(min=1)])
     color = SelectField(
-        'Szín',
+        'Szín', choices=EVENT_COLORS, default='blue', validators=[DataRequired()]
+    )
+    submit = SubmitField('Mentés')
+
+
+class EventSeriesForm(FlaskForm):
+    """Weekly recurring event; the edit view drops ``weekday`` and ``start_date``."""
+    name = StringField('Esemény neve', validators=[DataRequired()])
+    weekday = SelectField(
+        'Nap',
         choices=[
-            ('darkgreen', 'Sötétzöld'),
-            ('red', 'Piros'),
-            ('blue', 'Kék'),
-            ('purple', 'Lila'),
-            ('orange', 'Narancs'),
-            ('burgundy', 'Bordó'),
-            ('darkblue', 'Sötétkék'),
+            (0, 'Hétfő'),
+            (1, 'Kedd'),
+            (2, 'Szerda'),
+            (3, 'Csütörtök'),
+            (4, 'Péntek'),
+            (5, 'Szombat'),
+            (6, 'Vasárnap'),
         ],
-        default='blue',
-        validators=[DataRequired()],
+        coerce=int,
+    )
+    start_time = TimeField('Kezdő időpont', validators=[DataRequired()])
+    end_time = TimeField('Vég időpont', validators=[DataRequired()])
+    capacity = IntegerField('Létszám', validators=[DataRequired(), NumberRange(min=1)])
+    color = SelectField(
+        'Szín', choices=EVENT_COLORS, default='blue', validators=[DataRequired()]
     )
+    start_date = DateField('Első nap', validators=[DataRequired()])
+    until = DateField('Utolsó nap', validators=[DataRequired()])
     submit = SubmitField('Mentés')
@@ -0,0 +1,217 @@
+"""Live seat availability pushed to the calendar with Server-Sent Events.
+
+One :class:`SeatPublisher` per process watches the schedule version and
+fans the free places of changed events out to every open
+``/events/stream`` connection.  Signups and unregistrations committed in
+this process wake it at once (:func:`notify_seat_change`); changes
+committed by other workers on the host are picked up by polling the
+schedule version in the shared database every ``SSE_POLL_INTERVAL``
+seconds.  That is one indexed query per process however many members
+watch, and none while nobody does.
+
+Connections wait on a condition variable and only wake for a change or
+the ``SSE_KEEPALIVE`` comment, so idle watchers cost no CPU, but each open
+stream holds a worker thread for as long as it lasts.  Streams are
+therefore off unless ``SSE_ENABLED`` is set, and then end after
+``SSE_MAX_AGE`` seconds; the browser reconnects after the ``retry`` delay.
+Messages carry the schedule version as their id, and a stream ends with
+the version it got to, so a reconnecting browser sends it back as
+``Last-Event-ID`` and first receives what it missed.
+
+Only enable the streams with workers that can hold many idle
+connections: a sync gunicorn worker would be blocked by a single open
+calendar tab.  Use an async worker, e.g. ``pip install gevent`` and
+``gunicorn -k gevent --worker-connections 1000 run:app`` (gevent patches
+the threads and condition variables used here), or at least
+``gunicorn -k gthread --threads N`` with N well above the number of
+calendar tabs expected to be open at once.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import select
+
+from .models import Event, db
+from .schedule import current_schedule_version
+
+_publisher = None
+
+
+def changed_seats(since):
+    """Return the free places of the events changed after version ``since``."""
+    rows = db.session.execute(
+        select(Event.id, Event.capacity, Event.registered_count).where(Event.version > since)
+    )
+    return [
+        {'id': event_id, 'capacity': capacity, 'spots_left': capacity - registered}
+        for event_id, capacity, registered in rows
+    ]
+
+
+def _message(version, events):
+    return f"id: {version}\ndata: {json.dumps({'version': version, 'events': events})}\n\n"
+
+
+class SeatPublisher:
+    """Single publisher thread fanning seat changes out to SSE streams."""
+
+    def __init__(self, app, poll_interval=1.0, keepalive=15.0, max_age=300.0, backlog=64):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.keepalive = keepalive
+        self.max_age = max_age
+        self._cond = threading.Condition()
+        self._messages = deque(maxlen=backlog)
+        self._seq = 0
+        self._watchers = 0
+        self._version = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def notify(self):
+        """Poll now instead of at the next interval."""
+        self._wake.set()
+
+    def watch(self, since=None):
+        """Return a :class:`SeatStream` of SSE messages for one connection.
+
+        Must be called inside an application context; the stream itself
+        does not touch the database.  With ``since`` the changes after
+        that schedule version are sent first.  The caller must call
+        :meth:`SeatStream.release` when the connection closes, whether or
+        not the stream was ever read.
+        """
+        with self._cond:
+            self._watchers += 1
+            seq = self._seq
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='seat-publisher', daemon=True
+                )
+                self._thread.start()
+        try:
+            version = current_schedule_version()
+            backlog = changed_seats(since) if since is not None and since < version else []
+        except Exception:
+            self._leave()
+            raise
+        with self._cond:
+            # Changes after ``version`` are published by the thread.
+            if self._version is None:
+                self._version = version
+        return SeatStream(self, seq, version, backlog)
+
+    def _leave(self):
+        with self._cond:
+            self._watchers -= 1
+
+    def _stream(self, seq, version, backlog):
+        deadline = time.monotonic() + self.max_age
+        yield _message(version, backlog) if backlog else 'retry: 5000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Let the browser reconnect from the version it got to.
+                yield f'id: {version}\n\n'
+                return
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._seq > seq, timeout=min(self.keepalive, remaining)
+                )
+                pending = [
+                    (message_version, text)
+                    for number, message_version, text in self._messages
+                    if number > seq
+                ]
+                # Messages already dropped from the backlog are lost.
+                lagged = bool(self._messages) and self._messages[0][0] > seq + 1
+                seq = self._seq
+            if lagged:
+                yield 'event: reload\ndata: {}\n\n'
+            for version, text in pending:
+                yield text
+            if not pending and time.monotonic() < deadline:
+                yield ': keepalive\n\n'
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._cond:
+                if not self._watchers:
+                    self._version = None
+                    continue
+                since = self._version
+            try:
+                self.poll(since)
+            except Exception:
+                logging.exception('Polling seat changes failed')
+
+    def poll(self, since):
+        with self.app.app_context():
+            try:
+                version = current_schedule_version()
+                if since is None or version == since:
+                    return
+                events = changed_seats(since)
+            finally:
+                db.session.remove()
+        with self._cond:
+            if self._version != since:
+                return
+            self._version = version
+            if events:
+                self._seq += 1
+                self._messages.append((self._seq, version, _message(version, events)))
+                self._cond.notify_all()
+
+
+class SeatStream:
+    """One open ``/events/stream`` connection of a :class:`SeatPublisher`.
+
+    Iterating yields the SSE messages until ``SSE_MAX_AGE`` has passed;
+    :meth:`release` gives the watcher back and may be called repeatedly.
+    """
+
+    def __init__(self, publisher, seq, version, backlog):
+        self._publisher = publisher
+        self._messages = publisher._stream(seq, version, backlog)
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self._messages
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._publisher._leave()
+
+
+def init_seat_publisher(app):
+    """Create the process-wide publisher; its thread starts with the first watcher."""
+    global _publisher
+    if _publisher is None:
+        _publisher = SeatPublisher(
+            app,
+            poll_interval=app.config.get('SSE_POLL_INTERVAL', 1.0),
+            keepalive=app.config.get('SSE_KEEPALIVE', 15.0),
+            max_age=app.config.get('SSE_MAX_AGE', 300.0),
+        )
+    return _publisher
+
+
+def seat_publisher():
+    return _publisher
+
+
+def notify_seat_change():
+    """Wake the publisher after a commit that changed free places."""
+    if _publisher is not None:
+        _publisher.notify()
@@ -0,0 +1,421 @@
+"""Durable email outbox and the background workers that drain it.
+
+Request handlers call :func:`enqueue_email` which only inserts an
+``OutboxEmail`` row.  An :class:`OutboxWorkerPool` started by
+``create_app`` claims pending rows, delivers them over long-lived
+authenticated SMTP connections and retries failures with exponential
+backoff.  Because the queue lives in the database, messages that were not
+delivered before a restart are picked up again by the next pool.
+"""
+
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import and_, case, delete, insert, or_, select, update
+
+from .models import OutboxEmail, db
+from .settings_cache import get_email_settings
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 465
+
+_pool = None
+
+
+def get_credentials():
+    """Return ``(email_from, email_password)`` for outgoing mail.
+
+    Values stored in ``EmailSettings`` take precedence over the
+    ``EMAIL_FROM``/``EMAIL_PASSWORD`` environment variables.
+    """
+    settings = get_email_settings()
+    email_from = os.getenv('EMAIL_FROM')
+    email_password = os.getenv('EMAIL_PASSWORD')
+    if settings:
+        if settings.email_from:
+            email_from = settings.email_from
+        if settings.email_password:
+            email_password = settings.email_password
+    return email_from, email_password
+
+
+def build_message(subject, html_content, to_email, email_from):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = email_from
+    msg['To'] = to_email
+    msg.set_content("Ez egy HTML formátumú e-mail.")
+    msg.add_alternative(html_content, subtype='html')
+    return msg
+
+
+class SMTPConnection:
+    """An authenticated SMTP session that is reused between messages.
+
+    The connection is opened lazily on the first :meth:`send` and kept
+    open afterwards.  Connections idle for longer than ``max_idle``
+    seconds are checked with ``NOOP`` before reuse, and a dropped
+    connection is reopened once before the error is propagated.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, max_idle=60):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self._smtp = None
+        self._login = None
+        self._last_used = 0.0
+
+    def _connect(self, email_from, email_password):
+        self.close()
+        smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        smtp.login(email_from, email_password)
+        self._smtp = smtp
+        self._login = (email_from, email_password)
+
+    def _ensure(self, email_from, email_password):
+        if self._smtp is None or self._login != (email_from, email_password):
+            self._connect(email_from, email_password)
+            return
+        if time.monotonic() - self._last_used > self.max_idle:
+            try:
+                self._smtp.noop()
+            except smtplib.SMTPException:
+                self._connect(email_from, email_password)
+
+    def send(self, msg, email_from, email_password):
+        self._ensure(email_from, email_password)
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._connect(email_from, email_password)
+            self._smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.max_idle:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+        self._login = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def enqueue_email(subject, html_content, to_email):
+    """Queue an email for background delivery and return the outbox row."""
+    message = OutboxEmail(subject=subject, html=html_content, to_email=to_email)
+    db.session.add(message)
+    db.session.commit()
+    if _pool is not None:
+        _pool.notify()
+    return message
+
+
+def enqueue_emails(messages):
+    """Queue ``(subject, html_content, to_email)`` tuples in one transaction.
+
+    Returns the number of queued messages.
+    """
+    rows = [
+        {'subject': subject, 'html': html_content, 'to_email': to_email}
+        for subject, html_content, to_email in messages
+    ]
+    if rows:
+        db.session.execute(insert(OutboxEmail), rows)
+        db.session.commit()
+        if _pool is not None:
+            _pool.notify()
+    return len(rows)
+
+
+class OutboxWorkerPool:
+    """Threads that deliver queued ``OutboxEmail`` rows.
+
+    Rows are claimed with a single conditional ``UPDATE`` so several pools
+    (one per gunicorn worker) can drain the same table without sending a
+    message twice.  Rows left in ``sending`` by a crashed process are
+    reclaimed once ``stale_after`` seconds have passed; a reclaim counts as
+    an attempt, so a message that keeps crashing its worker ends up
+    ``failed``.  Sent rows older than ``retention`` seconds are deleted
+    about once an hour (``retention`` 0 keeps them).
+    """
+
+    def __init__(
+        self,
+        app,
+        workers=2,
+        poll_interval=5.0,
+        batch_size=20,
+        max_attempts=8,
+        backoff_base=30,
+        backoff_max=3600,
+        stale_after=600,
+        retention=30 * 86400,
+        prune_interval=3600,
+    ):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stale_after = stale_after
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._prune_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"outbox-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        with SMTPConnection() as conn:
+            while not self._stopping.is_set():
+                try:
+                    with self.app.app_context():
+                        processed = self.process_batch(conn)
+                        if not processed and self._prune_due():
+                            self.prune()
+                except Exception:
+                    logging.exception('Outbox worker failed')
+                    processed = 0
+                if not processed:
+                    conn.close_if_idle()
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+
+    def _prune_due(self):
+        # Only one thread of the pool prunes per interval.
+        if self.retention <= 0:
+            return False
+        with self._prune_lock:
+            now = time.monotonic()
+            if now < self._next_prune:
+                return False
+            self._next_prune = now + self.prune_interval
+            return True
+
+    def prune(self):
+        """Delete sent messages older than ``retention`` seconds."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        result = db.session.execute(
+            delete(OutboxEmail).where(OutboxEmail.status == 'sent', OutboxEmail.sent_at < cutoff)
+        )
+        db.session.commit()
+        return result.rowcount
+
+    def claim(self):
+        """Atomically claim up to ``batch_size`` due messages."""
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        stale = and_(
+            OutboxEmail.status == 'sending',
+            OutboxEmail.claimed_at < now - timedelta(seconds=self.stale_after),
+        )
+        due = or_(
+            and_(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now),
+            stale,
+        )
+        candidates = (
+            select(OutboxEmail.id)
+            .where(due)
+            .order_by(OutboxEmail.id)
+            .limit(self.batch_size)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.id.in_(candidates), due)
+            .values(
+                status='sending',
+                claimed_at=now,
+                claim_token=token,
+                # The worker that claimed a stale row died while sending it.
+                attempts=case((stale, OutboxEmail.attempts + 1), else_=OutboxEmail.attempts),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return OutboxEmail.query.filter_by(claim_token=token, status='sending').all()
+
+    def process_batch(self, conn):
+        messages = self.claim()
+        if not messages:
+            return 0
+        email_from, email_password = get_credentials()
+        for message in messages:
+            if message.attempts >= self.max_attempts:
+                message.status = 'failed'
+                message.last_error = 'Worker stopped while sending.'
+                db.session.commit()
+                continue
+            try:
+                if not email_from or not email_password:
+                    raise RuntimeError('Email credentials are not configured.')
+                conn.send(
+                    build_message(message.subject, message.html, message.to_email, email_from),
+                    email_from,
+                    email_password,
+                )
+            except Exception as exc:
+                logging.error('Failed to send email: %s', exc)
+                conn.close()
+                self._record_failure(message, exc)
+            else:
+                message.status = 'sent'
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+            db.session.commit()
+        return len(messages)
+
+    def _record_failure(self, message, exc):
+        message.attempts += 1
+        message.last_error = str(exc)
+        if message.attempts >= self.max_attempts:
+            message.status = 'failed'
+            return
+        delay = min(self.backoff_base * 2 ** (message.attempts - 1), self.backoff_max)
+        message.status = 'pending'
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+class RateLimiter:
+    """Token bucket limiting how many messages per second are sent.
+
+    A ``rate`` of ``0`` or less disables the limit.  The limiter is thread
+    safe so it can be shared by all parallel bulk senders.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _send_batch(subject, html_content, recipients, credentials, limiter):
+    """Deliver one batch over a single SMTP session.
+
+    Returns the addresses that could not be delivered.
+    """
+    email_from, email_password = credentials
+    failed = []
+    with SMTPConnection() as conn:
+        for to_email in recipients:
+            limiter.acquire()
+            try:
+                conn.send(
+                    build_message(subject, html_content, to_email, email_from),
+                    email_from,
+                    email_password,
+                )
+            except Exception as exc:
+                logging.error('Failed to send email to %s: %s', to_email, exc)
+                conn.close()
+                failed.append(to_email)
+    return failed
+
+
+def send_bulk(subject, html_content, chunks, batch_size=50, senders=2, rate=0, on_chunk=None):
+    """Send the same email to every address yielded by ``chunks``.
+
+    ``chunks`` yields lists of ``(key, email)`` tuples.  Each chunk is split
+    into batches of ``batch_size`` recipients which are delivered by up to
+    ``senders`` threads, one authenticated SMTP session per batch, with the
+    overall throughput capped at ``rate`` messages per second.  After a
+    chunk is fully processed ``on_chunk(last_key, sent, failed)`` is called
+    so callers can checkpoint their progress.
+    """
+    credentials = get_credentials()
+    if not all(credentials):
+        logging.error('Email credentials are not configured.')
+        return False
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=senders, thread_name_prefix='bulk-mail') as executor:
+        for chunk in chunks:
+            addresses = [email for _, email in chunk]
+            futures = [
+                executor.submit(
+                    _send_batch,
+                    subject,
+                    html_content,
+                    addresses[i:i + batch_size],
+                    credentials,
+                    limiter,
+                )
+                for i in range(0, len(addresses), batch_size)
+            ]
+            failed = [email for future in futures for email in future.result()]
+            if on_chunk:
+                on_chunk(chunk[-1][0], len(addresses) - len(failed), failed)
+    return True
+
+
+def start_outbox_workers(app):
+    """Start the process-wide outbox pool configured by ``OUTBOX_WORKERS``."""
+    global _pool
+    workers = app.config.get('OUTBOX_WORKERS', 0)
+    if workers <= 0 or _pool is not None:
+        return _pool
+    _pool = OutboxWorkerPool(
+        app,
+        workers=workers,
+        poll_interval=app.config.get('OUTBOX_POLL_INTERVAL', 5.0),
+        retention=app.config.get('OUTBOX_RETENTION_DAYS', 30) * 86400,
+    )
+    _pool.start()
+    return _pool
@@ -0,0 +1,239 @@
+"""Versioned schema migrations applied by ``create_app``.
+
+The schema version is stored in the single-row ``schema_version`` table.
+On an up-to-date database :func:`upgrade` costs one ``SELECT``.  Otherwise
+it takes SQLite's write lock, so concurrently starting workers apply the
+pending migrations exactly once, creates tables that do not exist yet with
+``create_all`` and runs every migration newer than the recorded version in
+order, all in one transaction.
+
+Migrations receive a SQLAlchemy connection and must be idempotent: a
+database that predates ``schema_version`` (or a brand-new one) starts at
+version 0 and runs all of them after ``create_all``.  To change the schema,
+update the models and append a function decorated with
+``@migration(<next number>)``.
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register the decorated function as migration number ``version``."""
+    def decorator(func):
+        MIGRATIONS.append((version, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def _indexes(conn, table):
+    return {row[1] for row in conn.execute(text(f"PRAGMA index_list({table})"))}
+
+
+def _add_column(conn, table, column, ddl):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _recount_registrations(conn):
+    conn.execute(
+        text(
+            "UPDATE event SET registered_count = (SELECT COUNT(*) FROM "
+            "event_registration WHERE event_registration.event_id = event.id)"
+        )
+    )
+
+
+@migration(1)
+def upgrade_legacy_schema(conn):
+    """Bring databases created before versioned migrations up to date.
+
+    These are the column and index checks ``create_app`` used to run on
+    every start.
+    """
+    # ``color`` was added to ``Event`` after the first release; old rows
+    # default to blue.
+    _add_column(conn, 'event', 'color', "VARCHAR(20) DEFAULT 'blue'")
+
+    # ``registered_count`` caches the number of registrations per event.
+    # Backfill it from the existing rows when it is added.
+    if 'registered_count' not in _columns(conn, 'event'):
+        conn.execute(
+            text("ALTER TABLE event ADD COLUMN registered_count INTEGER NOT NULL DEFAULT 0")
+        )
+        _recount_registrations(conn)
+
+    # Older databases allowed duplicate registrations. Drop them (and fix
+    # the counters) before adding the unique index.
+    if 'uq_event_registration_event_user' not in _indexes(conn, 'event_registration'):
+        conn.execute(
+            text(
+                "DELETE FROM event_registration WHERE id NOT IN (SELECT MIN(id) "
+                "FROM event_registration GROUP BY event_id, user_id)"
+            )
+        )
+        _recount_registrations(conn)
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX uq_event_registration_event_user "
+                "ON event_registration (event_id, user_id)"
+            )
+        )
+
+    # Expression indexes used by the member search.
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_user_username_lower ON user (lower(username))")
+    )
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_user_email_lower ON user (lower(email))")
+    )
+
+    _add_column(conn, 'user', 'weekly_reminder_opt_in', "BOOLEAN DEFAULT 0")
+
+    for column, ddl in (
+        ('event_signup_user_enabled', "BOOLEAN DEFAULT 0"),
+        ('event_signup_user_text', "TEXT"),
+        ('event_signup_admin_enabled', "BOOLEAN DEFAULT 0"),
+        ('event_signup_admin_text', "TEXT"),
+        ('event_unregister_user_enabled', "BOOLEAN DEFAULT 0"),
+        ('event_unregister_user_text', "TEXT"),
+        ('event_unregister_admin_enabled', "BOOLEAN DEFAULT 0"),
+        ('event_unregister_admin_text', "TEXT"),
+        ('weekly_reminder_enabled', "BOOLEAN DEFAULT 0"),
+        ('weekly_reminder_text', "TEXT"),
+        ('weekly_reminder_day', "INTEGER DEFAULT 0"),
+        ('weekly_reminder_time', "TIME"),
+    ):
+        _add_column(conn, 'email_settings', column, ddl)
+
+    # The schedule version counter is a single row which is only ever
+    # updated, see app.schedule.
+    conn.execute(
+        text(
+            "INSERT INTO schedule_version (id, version) "
+            "SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM schedule_version WHERE id = 1)"
+        )
+    )
+
+
+@migration(2)
+def add_lookup_indexes(conn):
+    """Index the foreign keys and filters used by the hot routes."""
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_pass_user_id ON pass (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_pass_type ON pass (type)",
+        "CREATE INDEX IF NOT EXISTS ix_pass_usage_pass_id_used_on ON pass_usage (pass_id, used_on)",
+        "CREATE INDEX IF NOT EXISTS ix_pass_usage_used_on ON pass_usage (used_on)",
+        "CREATE INDEX IF NOT EXISTS ix_event_start_time ON event (start_time)",
+        "CREATE INDEX IF NOT EXISTS ix_event_registration_user_id ON event_registration (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_user_weekly_reminder_opt_in ON user (weekly_reminder_opt_in)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(3)
+def add_pass_qr_version(conn):
+    _add_column(conn, 'pass', 'qr_version', "INTEGER NOT NULL DEFAULT 1")
+
+
+@migration(4)
+def add_pass_usage_idempotency_key(conn):
+    _add_column(conn, 'pass_usage', 'idempotency_key', "VARCHAR(64)")
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_pass_usage_idempotency_key "
+            "ON pass_usage (idempotency_key)"
+        )
+    )
+
+
+@migration(5)
+def add_member_import(conn):
+    """Nothing to alter: ``create_all`` adds the ``member_import`` table."""
+
+
+@migration(6)
+def add_event_series(conn):
+    _add_column(conn, 'event', 'series_id', "INTEGER REFERENCES event_series (id)")
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_event_series_start "
+            "ON event (series_id, start_time)"
+        )
+    )
+
+
+@migration(7)
+def add_event_version(conn):
+    _add_column(conn, 'event', 'version', "INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(8)
+def add_event_version_index(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_event_version ON event (version)"))
+
+
+@migration(9)
+def add_user_calendar_token(conn):
+    _add_column(conn, 'user', 'calendar_token', "VARCHAR(64)")
+    conn.execute(
+        text(
+            "UPDATE user SET calendar_token = lower(hex(randomblob(24))) "
+            "WHERE calendar_token IS NULL"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_calendar_token "
+            "ON user (calendar_token)"
+        )
+    )
+
+
+def current_version(conn):
+    """Return the recorded schema version or ``None`` if none is recorded."""
+    try:
+        return conn.execute(text("SELECT version FROM schema_version")).scalar()
+    except OperationalError:
+        conn.rollback()
+        return None
+
+
+def upgrade(engine, metadata):
+    """Apply pending migrations to the database behind ``engine``."""
+    target = latest_version()
+    with engine.connect() as conn:
+        if current_version(conn) == target:
+            return
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        # Any write starts the transaction and takes SQLite's RESERVED lock;
+        # other processes starting at the same time wait here and then find
+        # the migrations already applied.
+        conn.execute(text("UPDATE schema_version SET version = version"))
+        version = current_version(conn)
+        if version is None:
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (0)"))
+            version = 0
+        if version >= target:
+            return
+        metadata.create_all(conn)
+        for number, func in MIGRATIONS:
+            if number > version:
+                logging.info('Applying schema migration %s (%s)', number, func.__name__)
+                func(conn)
+        conn.execute(text("UPDATE schema_version SET version = :v"), {'v': target})
@@ -1,8 +1,14 @@
 from flask_login import UserMixin
 from datetime import datetime
+import secrets
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import db, login_manager
 
+def new_calendar_token():
+    """Return a random token for the personal calendar feed URL."""
+    return secrets.token_urlsafe(24)
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), nullable=False, unique=True)
@@ -22,6 +28,18 @@ class User(UserMixin, db.Model):
     )
 
     weekly_reminder_opt_in = db.Column(db.Boolean, default=False)
+    # Secret part of the personal calendar feed URL, see
+    # ``app.calendar_feed``; replaced when the member asks for a new link.
+    calendar_token = db.Column(db.String(64), default=new_calendar_token)
+
+    # Case-insensitive prefix search (see ``utils.search_users``) runs as a
+    # range scan on these expression indexes.
+    __table_args__ = (
+        db.Index('ix_user_username_lower', db.func.lower(username)),
+        db.Index('ix_user_email_lower', db.func.lower(email)),
+        db.Index('ix_user_weekly_reminder_opt_in', weekly_reminder_opt_in),
+        db.Index('uq_user_calendar_token', calendar_token, unique=True),
+    )
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -40,15 +58,33 @@ class Pass(db.Model):
     used = db.Column(db.Integer, default=0)
     comment = db.Column(db.String(255))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Part of the signed QR token (see ``app.pass_codes``); incrementing it
+    # invalidates every QR code issued for the pass so far.
+    qr_version = db.Column(db.Integer, nullable=False, default=1)
     usages = db.relationship(
         'PassUsage', backref='pass_ref', lazy=True, cascade='all, delete-orphan'
     )
 
+    __table_args__ = (
+        db.Index('ix_pass_user_id', user_id),
+        db.Index('ix_pass_type', type),
+    )
+
 
 class PassUsage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     pass_id = db.Column(db.Integer, db.ForeignKey('pass.id'), nullable=False)
     used_on = db.Column(db.DateTime, default=datetime.utcnow)
+    # Client supplied key of the check-in request that recorded this use,
+    # see ``app.checkins``.
+    idempotency_key = db.Column(db.String(64))
+
+    __table_args__ = (
+        # ``undo_use`` looks up the latest usage of a pass, reports scan by date.
+        db.Index('ix_pass_usage_pass_id_used_on', pass_id, used_on),
+        db.Index('ix_pass_usage_used_on', used_on),
+        db.Index('uq_pass_usage_idempotency_key', idempotency_key, unique=True),
+    )
 
 
 @login_manager.user_loader
@@ -94,6 +130,122 @@ class EmailSettings(db.Model):
     weekly_reminder_time = db.Column(db.Time)
 
 
+class OutboxEmail(db.Model):
+    """Notification email waiting to be delivered by the outbox workers.
+
+    Request handlers only insert rows here; :mod:`app.mailer` drains the
+    table in the background so a slow SMTP server never delays a response
+    and queued messages survive a restart.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    to_email = db.Column(db.String(150), nullable=False)
+    # 'pending', 'sending', 'sent' or 'failed'
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_outbox_email_status_next', 'status', 'next_attempt_at'),
+    )
+
+
+class ReminderRun(db.Model):
+    """Progress of one weekly reminder delivery.
+
+    ``last_user_id`` is the keyset cursor of the last fully delivered chunk,
+    so a run that crashed resumes after it instead of emailing everybody
+    again.  ``locked_until`` is a lease which keeps the scheduler in other
+    worker processes from delivering the same run concurrently.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    run_key = db.Column(db.String(20), nullable=False, unique=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    locked_until = db.Column(db.DateTime)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MemberImport(db.Model):
+    """Progress and row-level errors of one CSV member import.
+
+    The upload is validated in the request; the valid rows are hashed and
+    inserted in the background (see :mod:`app.member_import`), which
+    updates this row after every batch so any worker can show progress.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255))
+    # 'running', 'done' or 'failed'
+    status = db.Column(db.String(10), nullable=False, default='running')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    # JSON list of ``[line, message]`` pairs.
+    errors = db.Column(db.Text, nullable=False, default='[]')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class ScheduleVersion(db.Model):
+    """Single-row counter bumped whenever the schedule changes.
+
+    Every flush touching ``Event`` or ``EventRegistration`` increments it
+    (see :mod:`app.schedule`), so caches of rendered calendar data can be
+    keyed by the version instead of being invalidated explicitly.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DeletedEvent(db.Model):
+    """Tombstone of a deleted event for delta clients of the schedule API.
+
+    ``version`` is the schedule version the deletion was committed with.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_deleted_event_version', version),
+    )
+
+
+class EventSeries(db.Model):
+    """Weekly recurring event, e.g. a class held every Tuesday at 18:00.
+
+    Occurrences are ordinary ``Event`` rows created in bulk up to a rolling
+    horizon; ``materialized_until`` is the last day they exist for.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(150), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    color = db.Column(db.String(20), nullable=False, default='blue')
+    start_date = db.Column(db.Date, nullable=False)
+    until = db.Column(db.Date, nullable=False)
+    materialized_until = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_event_series_materialized_until', materialized_until),
+    )
+
+    DAY_NAMES = ['Hétfő', 'Kedd', 'Szerda', 'Csütörtök', 'Péntek', 'Szombat', 'Vasárnap']
+
+    @property
+    def weekday_name(self) -> str:
+        return self.DAY_NAMES[self.weekday]
+
+
 class Event(db.Model):
     """Calendar event which users can sign up for."""
     id = db.Column(db.Integer, primary_key=True)
@@ -102,10 +254,27 @@ class Event(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
     color = db.Column(db.String(20), nullable=False, default='blue')
+    # Denormalized number of registrations, maintained with conditional
+    # UPDATEs in :mod:`app.registrations` so capacity checks never have to
+    # load the roster and concurrent signups cannot overbook the event.
+    registered_count = db.Column(db.Integer, nullable=False, default=0)
+    # Schedule version of the last change to the event or its roster, see
+    # ``app.schedule``.
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Recurring series the event is an occurrence of, see ``app.event_series``.
+    series_id = db.Column(db.Integer, db.ForeignKey('event_series.id'))
     registrations = db.relationship(
         'EventRegistration', backref='event', lazy=True, cascade='all, delete-orphan'
     )
 
+    __table_args__ = (
+        db.Index('ix_event_start_time', start_time),
+        # Delta queries of the schedule API, see ``app.schedule_api``.
+        db.Index('ix_event_version', version),
+        # One occurrence per series and start; also serves series-wide edits.
+        db.Index('uq_event_series_start', series_id, start_time, unique=True),
+    )
+
     COLOR_MAP = {
         'darkgreen': '#006400',
         'red': '#dc3545',
@@ -123,7 +292,7 @@ class Event(db.Model):
 
     @property
     def spots_left(self) -> int:
-        return self.capacity - len(self.registrations)
+        return self.capacity - self.registered_count
 
     @property
     def formatted_time(self) -> str:
@@ -167,4 +336,11 @@ class EventRegistration(db.Model):
     # ``EventRegistration`` instances, so the explicit relationship here is
     # unnecessary and leads to conflicts when the models are imported.
 
+    __table_args__ = (
+        db.Index(
+            'uq_event_registration_event_user', 'event_id', 'user_id', unique=True
+        ),
+        db.Index('ix_event_registration_user_id', 'user_id'),
+    )
+
 
@@ -0,0 +1,88 @@
+"""Signed QR codes for front-desk check-in.
+
+Each pass is identified by a token signed with the application's
+``SECRET_KEY`` which carries the pass id and ``Pass.qr_version``, so it
+cannot be forged or altered, and bumping the version revokes every code
+printed or saved before.  The QR image encodes the scan URL of the token.
+Rendering a QR code with qrcode/PIL is slow, so the PNGs are kept in a
+process-local LRU cache backed by ``QR_CACHE_DIR`` on disk; both are keyed
+by pass id, version and a digest of the encoded URL.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+
+from flask import current_app, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from .schedule import FragmentCache
+from .utils import qr_png
+
+_png_cache = FragmentCache(maxsize=256)
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='pass-qr')
+
+
+def pass_token(p):
+    """Return the signed check-in token of pass ``p``."""
+    return _serializer().dumps([p.id, p.qr_version])
+
+
+def load_pass_token(token):
+    """Return ``(pass_id, qr_version)`` for a valid token, else ``None``.
+
+    Scanners type the whole encoded URL, so anything up to the last ``/``
+    is ignored.
+    """
+    token = token.strip().rstrip('/').rsplit('/', 1)[-1]
+    try:
+        pass_id, version = _serializer().loads(token)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    if not isinstance(pass_id, int) or not isinstance(version, int):
+        return None
+    return pass_id, version
+
+
+def pass_qr_png(p):
+    """Return the PNG bytes of the QR code for pass ``p``."""
+    data = url_for('admin.scan_pass', token=pass_token(p), _external=True)
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+    key = (p.id, p.qr_version, digest)
+    png = _png_cache.get(key)
+    if png is not None:
+        return png
+    cache_dir = current_app.config.get('QR_CACHE_DIR')
+    path = os.path.join(cache_dir, f'{p.id}-{p.qr_version}-{digest}.png') if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path, 'rb') as fh:
+            png = fh.read()
+    else:
+        png = qr_png(data)
+        if path:
+            _write_atomic(path, png)
+    _png_cache.set(key, png)
+    return png
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.qr-', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def discard_pass_qr(pass_id):
+    """Remove the cached PNGs of ``pass_id`` after its version was bumped."""
+    cache_dir = current_app.config.get('QR_CACHE_DIR')
+    if cache_dir:
+        for path in glob.glob(os.path.join(cache_dir, f'{pass_id}-*.png')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,100 @@
+"""Race-free event signups backed by ``Event.registered_count``.
+
+A place is reserved with a single conditional ``UPDATE`` which only
+succeeds while ``registered_count < capacity``, and the registration row is
+inserted in the same transaction.  The unique index on
+``(event_id, user_id)`` rejects duplicates, rolling back the reservation,
+so concurrent requests can neither overbook an event nor register a member
+twice.
+"""
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import Event, EventRegistration, db
+from .live_seats import notify_seat_change
+from .schedule import bump_schedule_version
+
+REGISTERED = 'registered'
+FULL = 'full'
+DUPLICATE = 'duplicate'
+
+
+def register_for_event(event_id, user_id):
+    """Register ``user_id`` for ``event_id`` and commit.
+
+    Returns :data:`REGISTERED`, :data:`FULL` or :data:`DUPLICATE`.
+    """
+    already = db.session.execute(
+        select(EventRegistration.id).where(
+            EventRegistration.event_id == event_id,
+            EventRegistration.user_id == user_id,
+        )
+    ).first()
+    if already:
+        return DUPLICATE
+    reserved = db.session.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.registered_count < Event.capacity)
+        .values(registered_count=Event.registered_count + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not reserved:
+        db.session.rollback()
+        return FULL
+    try:
+        db.session.execute(insert(EventRegistration).values(event_id=event_id, user_id=user_id))
+    except IntegrityError:
+        db.session.rollback()
+        return DUPLICATE
+    bump_schedule_version(db.session.connection(), [event_id])
+    db.session.commit()
+    notify_seat_change()
+    return REGISTERED
+
+
+def unregister_from_event(event_id, user_id):
+    """Remove a registration and release its place.
+
+    Returns ``False`` if the user was not registered (for example because a
+    concurrent request removed it first).
+    """
+    deleted = db.session.execute(
+        delete(EventRegistration).where(
+            EventRegistration.event_id == event_id,
+            EventRegistration.user_id == user_id,
+        )
+    ).rowcount
+    if not deleted:
+        db.session.rollback()
+        return False
+    db.session.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.registered_count > 0)
+        .values(registered_count=Event.registered_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    bump_schedule_version(db.session.connection(), [event_id])
+    db.session.commit()
+    notify_seat_change()
+    return True
+
+
+def release_user_registrations(user_id):
+    """Give back the places held by ``user_id`` before the user is deleted.
+
+    Deleting a ``User`` removes its registrations through the ORM cascade,
+    which does not know about ``registered_count``.  Runs in the caller's
+    transaction.
+    """
+    db.session.execute(
+        update(Event)
+        .where(
+            Event.id.in_(
+                select(EventRegistration.event_id).where(EventRegistration.user_id == user_id)
+            ),
+            Event.registered_count > 0,
+        )
+        .values(registered_count=Event.registered_count - 1)
+        .execution_options(synchronize_session=False)
+    )
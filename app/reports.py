@@ -0,0 +1,253 @@
+"""Monthly PDF reports rendered in the background with reportlab.
+
+Two reports are available for a calendar month (``YYYY-MM``):
+
+``usage``
+    uses per pass and member, with per-member and overall totals;
+``attendance``
+    every event of the month with its capacity, registrations and the
+    members checked in through the event (see ``app.checkins``).
+
+Rows are aggregated in SQL and streamed to the renderer.  Finished PDFs
+are stored in ``REPORT_DIR`` under a name containing the period and a
+version of the underlying data (a cheap fingerprint of the month's usages
+on the ``used_on`` index, plus the schedule version for attendance), so a
+report is rendered once per change of its data and every worker process
+can serve it.  :func:`request_report` never renders in the caller's
+thread: it returns the cached file or queues the rendering on a
+single background thread.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from sqlalchemy import String, cast, func, literal, select
+
+from .models import Event, Pass, PassUsage, User, db
+from .schedule import current_schedule_version
+
+REPORT_KINDS = {
+    'usage': 'Bérlethasználat',
+    'attendance': 'Részvétel',
+}
+FONT_CANDIDATES = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/DejaVuSans.ttf',
+)
+STREAM_CHUNK = 500
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+_font = None
+
+
+def parse_period(period):
+    """Return ``(first_day, first_day_of_next_month)`` for ``YYYY-MM``.
+
+    Raises ``ValueError`` for anything else.
+    """
+    start = datetime.strptime(period, '%Y-%m').date()
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def _usage_fingerprint(start, end):
+    # count/sum/max of ids is answered from ``ix_pass_usage_used_on`` alone.
+    row = db.session.execute(
+        select(func.count(PassUsage.id), func.sum(PassUsage.id), func.max(PassUsage.id))
+        .where(PassUsage.used_on >= start, PassUsage.used_on < end)
+    ).one()
+    return f'{row[0]}.{row[1] or 0}.{row[2] or 0}'
+
+
+def data_version(kind, period):
+    """Return a short digest identifying the data a report would show."""
+    start, end = parse_period(period)
+    version = _usage_fingerprint(start, end)
+    if kind == 'attendance':
+        version += f'.{current_schedule_version()}'
+    return hashlib.sha1(version.encode('ascii')).hexdigest()[:12]
+
+
+def report_path(report_dir, kind, period, version):
+    return os.path.join(report_dir, f'{kind}-{period}-{version}.pdf')
+
+
+def _stream(statement):
+    return db.session.execute(statement.execution_options(yield_per=STREAM_CHUNK))
+
+
+def _usage_rows(start, end):
+    uses = func.count(PassUsage.id).label('uses')
+    statement = (
+        select(
+            User.username,
+            Pass.id,
+            Pass.type,
+            uses,
+            func.min(PassUsage.used_on),
+            func.max(PassUsage.used_on),
+        )
+        .select_from(PassUsage)
+        .join(Pass, Pass.id == PassUsage.pass_id)
+        .join(User, User.id == Pass.user_id)
+        .where(PassUsage.used_on >= start, PassUsage.used_on < end)
+        .group_by(Pass.id)
+        .order_by(func.lower(User.username), Pass.id)
+    )
+    header = ['Felhasználó', 'Bérlet', 'Típus', 'Alkalmak', 'Első', 'Utolsó']
+    rows = [header]
+    member, member_total, total = None, 0, 0
+    for username, pass_id, pass_type, count, first, last in _stream(statement):
+        if member is not None and username != member:
+            rows.append(['', '', f'{member} összesen', member_total, '', ''])
+            member_total = 0
+        member = username
+        member_total += count
+        total += count
+        rows.append([
+            username, f'#{pass_id}', pass_type, count,
+            first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'),
+        ])
+    if member is not None:
+        rows.append(['', '', f'{member} összesen', member_total, '', ''])
+    rows.append(['Összesen', '', '', total, '', ''])
+    return rows
+
+
+def _attendance_rows(start, end):
+    # Check-ins of an event are keyed ``event:<id>:user:<user id>``; the
+    # range below is answered from the unique index on the key.
+    prefix = literal('event:') + cast(Event.id, String) + literal(':user:')
+    checked_in = (
+        select(func.count(PassUsage.id))
+        .where(
+            PassUsage.idempotency_key >= prefix,
+            PassUsage.idempotency_key < literal('event:') + cast(Event.id, String) + literal(':user;'),
+        )
+        .correlate(Event)
+        .scalar_subquery()
+    )
+    statement = (
+        select(
+            Event.start_time,
+            Event.name,
+            Event.capacity,
+            Event.registered_count,
+            checked_in,
+        )
+        .where(Event.start_time >= start, Event.start_time < end)
+        .order_by(Event.start_time)
+    )
+    rows = [['Időpont', 'Esemény', 'Férőhely', 'Jelentkezett', 'Megjelent']]
+    totals = [0, 0, 0]
+    for start_time, name, capacity, registered, present in _stream(statement):
+        rows.append([start_time.strftime('%Y-%m-%d %H:%M'), name, capacity, registered, present])
+        totals = [totals[0] + capacity, totals[1] + registered, totals[2] + present]
+    rows.append(['Összesen', '', *totals])
+    return rows
+
+
+def _register_font(configured=None):
+    """Return a font name able to print Hungarian text."""
+    global _font
+    if _font:
+        return _font
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    for path in (configured, *FONT_CANDIDATES):
+        if path and os.path.exists(path):
+            pdfmetrics.registerFont(TTFont('ReportSans', path))
+            _font = 'ReportSans'
+            return _font
+    logging.warning('No TrueType font found for reports; ő and ű will not print.')
+    _font = 'Helvetica'
+    return _font
+
+
+def _render(rows, title, path, font):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    style = getSampleStyleSheet()['Title']
+    style.fontName = font
+    table = Table(rows, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.whitesmoke),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+    doc = SimpleDocTemplate(path, pagesize=A4, title=title)
+    doc.build([Paragraph(title, style), Spacer(1, 12), table])
+
+
+def build_report(app, kind, period, version):
+    """Render a report into ``REPORT_DIR`` (runs on the background thread)."""
+    try:
+        with app.app_context():
+            start, end = parse_period(period)
+            rows = (_usage_rows if kind == 'usage' else _attendance_rows)(start, end)
+            db.session.remove()
+        report_dir = app.config['REPORT_DIR']
+        os.makedirs(report_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.report-', suffix='.pdf', dir=report_dir)
+        os.close(fd)
+        try:
+            _render(
+                rows,
+                f'{REPORT_KINDS[kind]} – {period}',
+                tmp_path,
+                _register_font(app.config.get('REPORT_FONT')),
+            )
+            path = report_path(report_dir, kind, period, version)
+            os.replace(tmp_path, path)
+            # Earlier versions of the same report are outdated now.
+            for old in glob.glob(report_path(report_dir, kind, period, '*')):
+                if old != path:
+                    try:
+                        os.remove(old)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception:
+        logging.exception('Rendering the %s report for %s failed', kind, period)
+    finally:
+        with _lock:
+            _pending.discard((kind, period, version))
+
+
+def request_report(app, kind, period):
+    """Return the path of the finished report or ``None`` while it is built.
+
+    Must be called inside an application context.  A missing report is
+    queued for rendering unless it is already being rendered.
+    """
+    global _executor
+    version = data_version(kind, period)
+    path = report_path(app.config['REPORT_DIR'], kind, period, version)
+    if os.path.exists(path):
+        return path
+    key = (kind, period, version)
+    with _lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reports')
+    _executor.submit(build_report, app, kind, period, version)
+    return None
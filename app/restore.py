@@ -0,0 +1,212 @@
+"""Replace the live SQLite database with an uploaded backup.
+
+:func:`restore_database` streams the upload (plain or gzip-compressed, as
+produced by :mod:`app.backup`) into a temporary file next to the database,
+checks it with ``PRAGMA integrity_check``, refuses files written by a newer
+schema and applies pending migrations to the copy.  Only then is it copied
+over the live database in a single transaction.  A truncated or foreign
+upload therefore leaves production untouched.
+
+After a restore the ``<database>.generation`` marker file is replaced.
+:func:`watch_database_file` compares it on every connection checkout, so
+pooled connections in all worker processes are recycled the next time they
+are used and the registered callbacks drop caches filled from the old data.
+:func:`generation_tag` names the current generation, so cache keys and
+ETags derived from counters such as the schedule version, which a restore
+can set back, never match a response built before the restore.
+"""
+
+import gzip
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+import zlib
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DisconnectionError
+
+from .migrations import latest_version, upgrade
+
+CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+REQUIRED_TABLES = {'user', 'pass', 'pass_usage'}
+
+_watched_path = None
+
+
+def _copy_upload(stream, target_path):
+    head = stream.read(2)
+    with open(target_path, 'wb') as out:
+        if head == GZIP_MAGIC:
+            rest = _Prefixed(head, stream)
+            with gzip.GzipFile(fileobj=rest, mode='rb') as source:
+                _copy_chunks(source, out)
+        else:
+            out.write(head)
+            _copy_chunks(stream, out)
+
+
+def _copy_chunks(source, out):
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        out.write(chunk)
+
+
+class _Prefixed:
+    """Read-only file object replaying ``head`` before the rest of ``stream``."""
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size=-1):
+        if self._head:
+            head, self._head = self._head, b''
+            if size is None or size < 0:
+                return head + self._stream.read()
+            return head + self._stream.read(max(size - len(head), 0))
+        return self._stream.read(size)
+
+
+def _validate(path):
+    """Raise ``ValueError`` unless ``path`` is a healthy, compatible database."""
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            if conn.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+                raise ValueError('A mentés sérült (integrity_check hiba).')
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            version = None
+            if 'schema_version' in tables:
+                version = conn.execute('SELECT version FROM schema_version').fetchone()
+                version = version[0] if version else None
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as exc:
+        raise ValueError('A feltöltött fájl nem SQLite adatbázis.') from exc
+    if not REQUIRED_TABLES <= tables:
+        raise ValueError('A feltöltött adatbázis nem ennek az alkalmazásnak a mentése.')
+    if version is not None and version > latest_version():
+        raise ValueError('A mentés újabb alkalmazásverzióval készült.')
+
+
+def restore_database(stream, db_path, metadata):
+    """Validate the backup read from ``stream`` and swap it in for ``db_path``.
+
+    Raises ``ValueError`` with a message for the admin if the upload is
+    rejected; the live database is unchanged in that case.
+    """
+    directory = os.path.dirname(db_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        try:
+            _copy_upload(stream, tmp_path)
+        except (OSError, EOFError) as exc:
+            raise ValueError('A feltöltött fájl nem olvasható.') from exc
+        _validate(tmp_path)
+        engine = create_engine(f'sqlite:///{tmp_path}')
+        try:
+            upgrade(engine, metadata)
+            with engine.connect() as conn:
+                # The page size (see ``_swap``) cannot change in WAL mode.
+                conn.exec_driver_sql('PRAGMA journal_mode=DELETE')
+        finally:
+            engine.dispose()
+        _swap(tmp_path, db_path)
+    finally:
+        for path in (tmp_path, tmp_path + '-wal', tmp_path + '-shm', tmp_path + '-journal'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _swap(tmp_path, db_path):
+    """Copy the validated database over ``db_path`` in one transaction.
+
+    The backup API writes through SQLite's own locking and journal, so
+    readers in every process see either the old or the new database and a
+    crash mid-copy rolls back.  (Renaming a file over a database in WAL
+    mode is not safe while other processes keep it open: the last of their
+    connections to close would delete the new database's ``-wal`` file.)
+    """
+    source = sqlite3.connect(tmp_path)
+    target = sqlite3.connect(db_path, timeout=30)
+    try:
+        page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        if source.execute('PRAGMA page_size').fetchone()[0] != page_size:
+            # A WAL-mode target only accepts pages of its own size.
+            source.execute(f'PRAGMA page_size={int(page_size)}')
+            source.execute('VACUUM')
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    _bump_generation(db_path)
+
+
+def _generation_path(db_path):
+    return db_path + '.generation'
+
+
+def _generation(db_path):
+    try:
+        stat = os.stat(_generation_path(db_path))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _bump_generation(db_path):
+    """Replace the marker file so every watcher sees a new generation."""
+    path = _generation_path(db_path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.generation-', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(uuid.uuid4().hex)
+    os.replace(tmp_path, path)
+
+
+def generation_tag():
+    """Return a short tag of the current restore generation.
+
+    Empty until the watched database is restored for the first time.
+    """
+    generation = _generation(_watched_path) if _watched_path else None
+    if generation is None:
+        return ''
+    return format(zlib.crc32(repr(generation).encode()), '08x')
+
+
+def watch_database_file(engine, db_path, on_swap=()):
+    """Recycle ``engine``'s connections after ``db_path`` has been restored.
+
+    Each new connection records the restore generation; a pooled
+    connection from an older generation is discarded on checkout.
+    ``on_swap`` callables are run once per process when a restore is first
+    noticed; they must not use the database.
+    """
+    global _watched_path
+    _watched_path = db_path
+    state = {'generation': _generation(db_path)}
+    lock = threading.Lock()
+
+    @event.listens_for(engine, 'connect')
+    def _remember_generation(dbapi_connection, connection_record):
+        connection_record.info['generation'] = _generation(db_path)
+
+    @event.listens_for(engine, 'checkout')
+    def _check_generation(dbapi_connection, connection_record, connection_proxy):
+        current = _generation(db_path)
+        if current == connection_record.info.get('generation'):
+            return
+        with lock:
+            if state['generation'] != current:
+                state['generation'] = current
+                for callback in on_swap:
+                    callback()
+        # The pool invalidates this connection and retries with a new one.
+        raise DisconnectionError('Database was restored from a backup')
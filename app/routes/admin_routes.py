@@ -5,29 +5,42 @@ from flask import (
     url_for,
     request,
     flash,
+    Response,
     send_file,
+    stream_with_context,
     current_app,
+    jsonify,
+    abort,
 )
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload, selectinload
+import json
 import os
 import shutil
+import uuid
 
-from ..models import Pass, PassUsage, User, db, EmailSettings
-from ..forms import PassForm, UserForm, EmailSettingsForm, RestoreForm
-from ..utils import send_event_email
+from ..models import Pass, PassUsage, User, db, EmailSettings, MemberImport
+from ..forms import PassForm, UserForm, EmailSettingsForm, RestoreForm, MemberImportForm
+from ..utils import search_users, send_email, send_notification
 from .. import update_weekly_reminder_schedule
-from ..email_templates import (
-    pass_created_email,
-    pass_deleted_email,
-    pass_used_email,
-    pass_usage_reverted_email,
-    registration_email,
-    base_email_template,
-)
-from datetime import date
+from ..settings_cache import invalidate_email_settings
+from ..registrations import release_user_registrations
+from ..email_templates import pass_created_email
+from ..backup import database_path, stream_backup
+from ..restore import restore_database
+from ..pass_codes import discard_pass_qr, load_pass_token, pass_token
+from ..checkins import CHECKED_IN, NOT_FOUND, REPLAYED, check_in
+from ..reports import REPORT_KINDS, parse_period, request_report
+from ..member_import import decode_upload, drop_taken, parse_members, start_import
+from ..exports import EXPORTS, FORMATS as EXPORT_FORMATS, export_rows, parse_range
+from ..schedule import grid_cache, participants_cache
+from ..calendar_feed import feed_cache
+from datetime import date, datetime
 
 admin_bp = Blueprint('admin', __name__)
 
+USERS_PAGE_SIZE = 50
+
 @admin_bp.route('/create_pass', methods=['GET', 'POST'])
 @login_required
 def create_pass():
@@ -35,10 +48,9 @@ def create_pass():
         return redirect(url_for('user.dashboard'))
 
     form = PassForm()
-    users = User.query.all()
-    form.user_id.choices = [(u.id, u.username) for u in users]
+    selected_user = db.session.get(User, form.user_id.data) if form.user_id.data else None
 
-    if form.validate_on_submit():
+    if form.validate_on_submit() and selected_user:
         new_pass = Pass(
             type=form.type.data,
             start_date=form.start_date.data,
@@ -50,16 +62,13 @@ def create_pass():
         )
         db.session.add(new_pass)
         db.session.commit()
-        send_event_email(
-            'pass_created',
-            "Új bérlet",
-            pass_created_email(new_pass),
-            new_pass.user.email
-        )
+        send_notification('pass_created', new_pass.user.email, p=new_pass)
         flash("Bérlet sikeresen létrehozva.", "success")
         return redirect(url_for('user.dashboard'))
 
-    return render_template('create_pass.html', form=form)
+    if form.is_submitted() and not selected_user:
+        flash("Válassz felhasználót.", "danger")
+    return render_template('create_pass.html', form=form, selected_user=selected_user)
 
 
 @admin_bp.route('/extend_pass/<int:pass_id>', methods=['GET', 'POST'])
@@ -70,9 +79,8 @@ def extend_pass(pass_id):
 
     p = Pass.query.get_or_404(pass_id)
     form = PassForm(obj=p)
-    users = User.query.all()
-    form.user_id.choices = [(u.id, u.username) for u in users]
-    if form.validate_on_submit():
+    selected_user = db.session.get(User, form.user_id.data) if form.user_id.data else None
+    if form.validate_on_submit() and selected_user:
         p.type = form.type.data
         p.start_date = form.start_date.data
         p.end_date = form.end_date.data
@@ -88,7 +96,11 @@ def extend_pass(pass_id):
         flash("Bérlet módosítva.", "success")
         return redirect(url_for('admin.verify_pass', pass_id=p.id))
 
-    return render_template('extend_pass.html', form=form, pass_id=pass_id, p=p)
+    if form.is_submitted() and not selected_user:
+        flash("Válassz felhasználót.", "danger")
+    return render_template(
+        'extend_pass.html', form=form, pass_id=pass_id, p=p, selected_user=selected_user
+    )
 
 @admin_bp.route('/delete_pass/<int:pass_id>')
 @login_required
@@ -108,11 +120,14 @@ def delete_pass(pass_id):
 
     db.session.delete(selected_pass)
     db.session.commit()
-    send_event_email(
+    send_notification(
         'pass_deleted',
-        "Bérlet törölve",
-        pass_deleted_email(user_name, pass_type, start_date, end_date, used),
         user_email,
+        username=user_name,
+        pass_type=pass_type,
+        start=start_date,
+        end=end_date,
+        used=used,
     )
     flash("Bérlet törölve.", "success")
     return redirect(url_for('user.dashboard'))
@@ -126,33 +141,133 @@ def verify_pass(pass_id):
 
     p = Pass.query.get_or_404(pass_id)
     today = date.today()
-    return render_template('verify_pass.html', p=p, today=today)
+    return render_template(
+        'verify_pass.html', p=p, today=today, idempotency_key=uuid.uuid4().hex
+    )
 
 
-@admin_bp.route('/use_pass/<int:pass_id>')
+@admin_bp.route('/scan', defaults={'token': None})
+@admin_bp.route('/scan/<token>')
 @login_required
-def use_pass(pass_id):
+def scan_pass(token):
+    """Show the pass behind a scanned QR code.
+
+    The QR code encodes ``/scan/<token>``; a USB scanner typing into the
+    form on this page submits the same URL or token as ``code``.
+    """
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
 
-    p = Pass.query.get_or_404(pass_id)
-    if p.used < p.total_uses and p.end_date >= date.today():
-        p.used += 1
-        usage = PassUsage(pass_id=pass_id)
-        db.session.add(usage)
-        db.session.commit()
-        send_event_email(
-            'pass_used',
-            "Bérlet használat",
-            pass_used_email(p),
-            p.user.email,
+    token = token or request.args.get('code', '')
+    if not token:
+        return render_template('scan.html')
+    loaded = load_pass_token(token)
+    p = None
+    if loaded:
+        pass_id, version = loaded
+        p = db.session.get(
+            Pass,
+            pass_id,
+            options=[joinedload(Pass.user), selectinload(Pass.usages)],
         )
+        if p is not None and p.qr_version != version:
+            p = None
+    if p is None:
+        return render_template('scan.html', error='Érvénytelen vagy visszavont QR-kód.'), 404
+    return render_template(
+        'verify_pass.html',
+        p=p,
+        today=date.today(),
+        scan=True,
+        idempotency_key=uuid.uuid4().hex,
+    )
+
+
+@admin_bp.route('/reset_qr/<int:pass_id>', methods=['POST'])
+@login_required
+def reset_pass_qr(pass_id):
+    """Issue a new QR code for the pass, revoking the previous ones."""
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    p = Pass.query.get_or_404(pass_id)
+    p.qr_version += 1
+    db.session.commit()
+    discard_pass_qr(pass_id)
+    flash("Új QR-kód készült.", "success")
+    return redirect(url_for('admin.verify_pass', pass_id=pass_id))
+
+
+@admin_bp.route('/use_pass/<int:pass_id>', methods=['POST'])
+@login_required
+def use_pass(pass_id):
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    # The form carries a key generated when the page was rendered, so a
+    # double click records a single use.
+    status, p = check_in(pass_id, request.form.get('idempotency_key'))
+    if p is None:
+        abort(404)
+    if status == CHECKED_IN:
+        send_notification('pass_used', p.user.email, p=p)
         flash("Alkalom hozzáadva.", "success")
-    else:
+    elif status != REPLAYED:
         flash("A bérlet nem használható.", "danger")
+    if request.form.get('scan'):
+        # Back to the scan view of the same pass, whose focused scanner
+        # field takes the next member's code.
+        return redirect(url_for('admin.scan_pass', token=pass_token(p)))
     return redirect(url_for('admin.verify_pass', pass_id=pass_id))
 
 
+@admin_bp.route('/api/checkin', methods=['POST'])
+@login_required
+def api_checkin():
+    """Record a pass use for scanner clients and answer with compact JSON.
+
+    The body is ``{"pass_id": 1}`` or ``{"token": "<QR token or URL>"}``; an
+    ``Idempotency-Key`` header (or ``idempotency_key`` field) makes retries
+    safe; a key already used for another pass is answered with 409.  Requests
+    need the session cookie and the CSRF token in the ``X-CSRFToken`` header
+    like every other POST.
+    """
+    if current_user.role != 'admin':
+        abort(403)
+
+    data = request.get_json(silent=True) or {}
+    pass_id = data.get('pass_id')
+    if data.get('token'):
+        loaded = load_pass_token(data['token'])
+        pass_id = loaded[0] if loaded else None
+        if loaded and db.session.execute(
+            db.select(Pass.qr_version).where(Pass.id == pass_id)
+        ).scalar() != loaded[1]:
+            pass_id = None
+    # ``True`` is an ``int`` too.
+    if not isinstance(pass_id, int) or isinstance(pass_id, bool):
+        return jsonify({'status': NOT_FOUND}), 404
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or len(key) > 64):
+        return jsonify({'status': 'invalid_key'}), 400
+
+    status, p = check_in(pass_id, key)
+    if p is None:
+        return jsonify({'status': status}), 404
+    if status == CHECKED_IN:
+        send_notification('pass_used', p.user.email, p=p)
+    body = {
+        'status': status,
+        'pass_id': p.id,
+        'user': p.user.username,
+        'type': p.type,
+        'used': p.used,
+        'total_uses': p.total_uses,
+        'end_date': p.end_date.isoformat(),
+    }
+    return jsonify(body), 200 if status in (CHECKED_IN, REPLAYED) else 409
+
+
 @admin_bp.route('/undo_use/<int:pass_id>')
 @login_required
 def undo_use(pass_id):
@@ -170,12 +285,7 @@ def undo_use(pass_id):
         if last_usage:
             db.session.delete(last_usage)
         db.session.commit()
-        send_event_email(
-            'pass_used',
-            "Bérlet használat visszavonva",
-            pass_usage_reverted_email(p),
-            p.user.email,
-        )
+        send_notification('pass_usage_reverted', p.user.email, p=p)
         flash("Felhasználás visszavonva.", "success")
     return redirect(url_for('admin.verify_pass', pass_id=pass_id))
 
@@ -185,8 +295,36 @@ def undo_use(pass_id):
 def users():
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
-    users = User.query.all()
-    return render_template('users.html', users=users)
+    q = request.args.get('q', '').strip()
+    if q:
+        # The template renders full ``User`` rows; load the hits with one
+        # query and keep the relevance order of the search.
+        ids = [row.id for row in search_users(q, limit=USERS_PAGE_SIZE)]
+        by_id = {u.id: u for u in User.query.filter(User.id.in_(ids))} if ids else {}
+        users = [by_id[user_id] for user_id in ids if user_id in by_id]
+        return render_template('users.html', users=users, q=q, next_after=None)
+    after = request.args.get('after', type=int)
+    query = User.query.order_by(User.id)
+    if after:
+        query = query.filter(User.id > after)
+    users = query.limit(USERS_PAGE_SIZE + 1).all()
+    next_after = None
+    if len(users) > USERS_PAGE_SIZE:
+        users = users[:USERS_PAGE_SIZE]
+        next_after = users[-1].id
+    return render_template('users.html', users=users, q=q, next_after=next_after)
+
+
+@admin_bp.route('/users/search', endpoint='search_users')
+@login_required
+def search_users_json():
+    """Return members matching the ``q`` prefix for the autocomplete pickers."""
+    if current_user.role != 'admin':
+        abort(403)
+    return jsonify([
+        {'id': row.id, 'username': row.username, 'email': row.email}
+        for row in search_users(request.args.get('q', ''))
+    ])
 
 
 @admin_bp.route('/create_user', methods=['GET', 'POST'])
@@ -210,11 +348,11 @@ def create_user():
         user.set_password(form.password.data)
         db.session.add(user)
         db.session.commit()
-        send_event_email(
+        send_notification(
             'user_created',
-            "Felhasználó létrehozva",
-            registration_email(user.username, form.password.data),
             user.email,
+            username=user.username,
+            password=form.password.data,
         )
         flash("Felhasználó létrehozva.", "success")
         return redirect(url_for('admin.users'))
@@ -222,6 +360,43 @@ def create_user():
     return render_template('create_user.html', form=form)
 
 
+@admin_bp.route('/import_users', methods=['GET', 'POST'])
+@login_required
+def import_users():
+    """Upload a CSV file of new members, imported in the background."""
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    form = MemberImportForm()
+    if form.validate_on_submit():
+        uploaded = form.csv_file.data
+        try:
+            rows, errors = parse_members(decode_upload(uploaded.stream.read()))
+        except ValueError as exc:
+            flash(str(exc), 'danger')
+            return render_template('import_users.html', form=form)
+        rows = drop_taken(rows, errors)
+        import_id = start_import(
+            current_app._get_current_object(), uploaded.filename, rows, errors
+        )
+        return redirect(url_for('admin.import_status', import_id=import_id))
+
+    return render_template('import_users.html', form=form)
+
+
+@admin_bp.route('/import_users/<int:import_id>')
+@login_required
+def import_status(import_id):
+    """Show the progress and the row-level errors of a member import."""
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    job = MemberImport.query.get_or_404(import_id)
+    return render_template(
+        'import_users.html', form=MemberImportForm(), job=job, errors=json.loads(job.errors)
+    )
+
+
 @admin_bp.route('/edit_user/<int:user_id>', methods=['GET', 'POST'])
 @login_required
 def edit_user(user_id):
@@ -269,14 +444,10 @@ def delete_user(user_id):
     username = user.username
     user_email = user.email
 
+    release_user_registrations(user.id)
     db.session.delete(user)
     db.session.commit()
-    send_event_email(
-        'user_deleted',
-        "Felhasználó törölve",
-        base_email_template("Felhasználó törölve", f"{username} törölve."),
-        user_email,
-    )
+    send_notification('user_deleted', user_email, username=username)
     flash("Felhasználó törölve.", "success")
     return redirect(url_for('admin.users'))
 
@@ -297,6 +468,7 @@ def email_settings():
     if form.validate_on_submit():
         form.populate_obj(settings)
         db.session.commit()
+        invalidate_email_settings()
         update_weekly_reminder_schedule(current_app)
         flash("Beállítások mentve.", "success")
         return redirect(url_for('user.dashboard'))
@@ -307,36 +479,111 @@ def email_settings():
 @admin_bp.route('/backup')
 @login_required
 def backup():
-    """Download a backup of the database file."""
+    """Download a consistent, gzip-compressed snapshot of the database."""
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
 
-    instance_dir = os.path.abspath(os.path.join(current_app.root_path, '..', 'instance'))
-    db_file = os.path.join(instance_dir, 'passes.db')
-    if not os.path.exists(db_file):
+    db_file = database_path(db.engine)
+    if not db_file or not os.path.exists(db_file):
         flash('Nincs adatbázis a mentéshez.', 'danger')
         return redirect(url_for('admin.email_settings'))
 
-    return send_file(db_file, as_attachment=True, download_name='passes_backup.db')
+    download_name = f"passes_backup_{datetime.now().strftime('%Y%m%d_%H%M')}.db.gz"
+    return Response(
+        stream_backup(db_file),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'},
+    )
+
+
+@admin_bp.route('/reports')
+@login_required
+def reports():
+    """Pick a monthly PDF report."""
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    return render_template(
+        'reports.html', kinds=REPORT_KINDS, period=date.today().strftime('%Y-%m')
+    )
+
+
+@admin_bp.route('/reports/<kind>/<period>')
+@login_required
+def download_report(kind, period):
+    """Send a finished report, or queue it and show a page that polls for it."""
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    try:
+        parse_period(period)
+    except ValueError:
+        abort(404)
+    if kind not in REPORT_KINDS:
+        abort(404)
+    path = request_report(current_app._get_current_object(), kind, period)
+    if path is None:
+        return render_template(
+            'reports.html', kinds=REPORT_KINDS, period=period, pending=kind
+        ), 202
+    return send_file(
+        path, mimetype='application/pdf', as_attachment=True,
+        download_name=f'{kind}_{period}.pdf',
+    )
+
+
+@admin_bp.route('/export')
+@admin_bp.route('/export/<name>.<fmt>')
+@login_required
+def export(name=None, fmt=None):
+    """Stream a table as CSV or JSON, optionally limited to a date range.
+
+    The reports form sends the table and format as the ``table`` and
+    ``format`` query parameters instead of in the path.
+    """
+    if current_user.role != 'admin':
+        return redirect(url_for('user.dashboard'))
+
+    name = name or request.args.get('table')
+    fmt = fmt or request.args.get('format')
+
+    if name not in EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    try:
+        start, end = parse_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        abort(400)
+    suffix = ''.join(f"_{value}" for value in (request.args.get('start'), request.args.get('end')) if value)
+    return Response(
+        stream_with_context(export_rows(name, fmt, start, end)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={name}{suffix}.{fmt}'},
+    )
 
 
 @admin_bp.route('/restore', methods=['GET', 'POST'])
 @login_required
 def restore():
-    """Restore the database from an uploaded backup file."""
+    """Restore the database from an uploaded (optionally gzipped) backup."""
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
 
     form = RestoreForm()
     if form.validate_on_submit():
         uploaded = form.backup_file.data
-        if uploaded:
-            instance_dir = os.path.abspath(os.path.join(current_app.root_path, '..', 'instance'))
-            os.makedirs(instance_dir, exist_ok=True)
-            db_file = os.path.join(instance_dir, 'passes.db')
+        db_file = database_path(db.engine)
+        if uploaded and db_file:
             db.session.remove()
-            db.engine.dispose()
-            uploaded.save(db_file)
+            try:
+                restore_database(uploaded.stream, db_file, db.metadata)
+            except ValueError as exc:
+                flash(str(exc), 'danger')
+                return render_template('restore.html', form=form)
+            invalidate_email_settings()
+            grid_cache.clear()
+            participants_cache.clear()
+            feed_cache.clear()
+            update_weekly_reminder_schedule(current_app)
             flash('Adatbázis visszaállítva.', 'success')
             return redirect(url_for('admin.email_settings'))
         flash('Nem megfelelő fájl.', 'danger')
@@ -1,15 +1,53 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    request,
+    flash,
+    get_template_attribute,
+    abort,
+    jsonify,
+    current_app,
+)
+from markupsafe import Markup
 from flask_login import login_required, current_user
-from datetime import datetime, timedelta
-
-from ..models import Event, EventRegistration, User, db
-from ..forms import EventForm
-from ..utils import send_event_email
-from ..email_templates import (
-    event_signup_user_email,
-    event_signup_admin_email,
-    event_unregister_user_email,
-    event_unregister_admin_email,
+from datetime import date, datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from ..models import Event, EventRegistration, EventSeries, Pass, User, db
+from ..forms import EventForm, EventSeriesForm
+from ..utils import send_notification, send_notifications
+from ..calendar_feed import (
+    feed_token,
+    feed_user,
+    public_feed,
+    reset_feed_token,
+    user_feed,
+)
+from ..checkins import check_in_event
+from ..live_seats import seat_publisher
+from ..schedule_api import MAX_DAYS, parse_window, schedule_payload
+from ..event_series import (
+    create_series,
+    delete_series,
+    materialize_series,
+    series_horizon,
+    update_series,
+)
+from ..restore import generation_tag
+from ..registrations import (
+    DUPLICATE,
+    FULL,
+    register_for_event,
+    unregister_from_event,
+)
+from ..schedule import (
+    CalendarGrid,
+    current_schedule_version,
+    grid_cache,
+    participants_cache,
 )
 
 
@@ -22,69 +60,217 @@ def _get_two_week_range():
     return start, end
 
 
-@event_bp.route('/events')
-@login_required
-def events():
-    start, end = _get_two_week_range()
+def _build_calendar_grid(start, end):
+    """Render the shared calendar grid for the two weeks from ``start``."""
     events = (
         Event.query.filter(Event.start_time >= start, Event.start_time <= end)
         .order_by(Event.start_time)
         .all()
     )
     days = [start + timedelta(days=i) for i in range(14)]
+    # One block per event, placed in the cell of its first hour and tall
+    # enough to run over the following rows (a cell is 60px, 1px a
+    # minute).  The roster is loaded by the popover when it opens.
     events_map = {}
     for e in events:
         day_idx = (e.start_time.date() - start).days
-        start_hour = e.start_time.hour
-        end_hour = e.end_time.hour
-        for hour in range(start_hour, end_hour + 1):
-            start_minute = e.start_time.minute if hour == start_hour else 0
-            end_minute = e.end_time.minute if hour == end_hour else 60
-            events_map.setdefault((day_idx, hour), []).append({
-                'event': e,
-                'start_minute': start_minute,
-                'end_minute': end_minute,
-                'is_first': hour == start_hour,
-            })
-    registrations = {
-        reg.event_id: reg
-        for reg in EventRegistration.query.filter_by(user_id=current_user.id)
-    }
-
-    participants = {
-        e.id: "<br>".join(reg.user.username for reg in e.registrations) or "nincs"
-        for e in events
-    }
+        start_minute = e.start_time.hour * 60 + e.start_time.minute
+        end_minute = e.end_time.hour * 60 + e.end_time.minute
+        if e.end_time.date() > e.start_time.date():
+            end_minute = 24 * 60
+        # Plus one pixel for each row border the block crosses.
+        borders = max(end_minute - 1, start_minute) // 60 - e.start_time.hour
+        events_map.setdefault((day_idx, e.start_time.hour), []).append({
+            'event': e,
+            'top': e.start_time.minute,
+            'height': max(end_minute - start_minute, 0) + borders,
+        })
+    spots_left = {e.id: e.spots_left for e in events}
+
+    html = render_template(
+        '_calendar_grid.html',
+        days=days,
+        events_map=events_map,
+    )
+    return CalendarGrid(html, spots_left)
+
+
+@event_bp.route('/events')
+@login_required
+def events():
+    start, end = _get_two_week_range()
+    materialize_series()
+    version = current_schedule_version()
+    key = (start, version)
+    grid = grid_cache.get(key)
+    if grid is None:
+        grid = _build_calendar_grid(start, end)
+        grid_cache.set(key, grid)
+
+    registered = set()
+    if grid.spots_left:
+        registered = set(
+            db.session.execute(
+                select(EventRegistration.event_id).where(
+                    EventRegistration.user_id == current_user.id,
+                    EventRegistration.event_id.in_(list(grid.spots_left)),
+                )
+            ).scalars()
+        )
+    actions = get_template_attribute('_calendar_actions.html', 'actions')
 
     return render_template(
         'events.html',
-        events=events,
         start=start,
         end=end,
-        registrations=registrations,
-        days=days,
-        events_map=events_map,
-        participants=participants,
+        version=version,
+        live_seats=current_app.config['SSE_ENABLED'],
+        feed_url=url_for(
+            'events.user_calendar', token=feed_token(current_user), _external=True
+        ),
+        grid=Markup(grid.render(
+            lambda event_id: actions(
+                event_id, event_id in registered, grid.spots_left[event_id]
+            )
+        )),
     )
 
 
+@event_bp.route('/events/<int:event_id>/participants')
+@login_required
+def event_participants(event_id):
+    """Participant list of an event for the calendar popover.
+
+    The rendered list is cached by ``Event.version`` and the restore
+    generation, which also make up the ETag, so reopening a popover is
+    answered with 304.
+    """
+    version = db.session.execute(
+        select(Event.version).where(Event.id == event_id)
+    ).scalar()
+    if version is None:
+        abort(404)
+    # A restore can set the version back, see ``app.restore``.
+    etag = f'{generation_tag()}p{event_id}-{version}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        body = participants_cache.get(etag)
+        if body is None:
+            usernames = db.session.execute(
+                select(User.username)
+                .join(EventRegistration, EventRegistration.user_id == User.id)
+                .where(EventRegistration.event_id == event_id)
+                .order_by(EventRegistration.id)
+            ).scalars()
+            body = Markup('<br>').join(usernames) or 'nincs'
+            participants_cache.set(etag, body)
+        response = current_app.response_class(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+@event_bp.route('/api/schedule')
+@login_required
+def api_schedule():
+    """Events of a date window as JSON, optionally only the changes.
+
+    Query parameters: ``start`` and ``end`` (``YYYY-MM-DD``, default the
+    two weeks from today) and ``since`` (a ``version`` of an earlier
+    response).  Answers 304 to a matching ``If-None-Match``.  Occurrences of
+    recurring series are listed up to ``MAX_DAYS`` days from today.
+    """
+    since = request.args.get('since')
+    try:
+        first, last = parse_window(request.args.get('start'), request.args.get('end'))
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({'error': 'invalid_parameters'}), 400
+    # Windows reaching past the rolling horizon get their occurrences
+    # created on demand, but not further than MAX_DAYS ahead.
+    materialize_series(max(series_horizon(), min(last, date.today() + timedelta(days=MAX_DAYS))))
+    version = current_schedule_version()
+    etag = f'{current_user.id}-{first}-{last}-{since}-{version}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(schedule_payload(current_user.id, first, last, version, since))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+@event_bp.route('/calendar/<token>.ics')
+def user_calendar(token):
+    """Personal iCalendar feed of the events the member signed up for."""
+    user = feed_user(token)
+    if user is None:
+        abort(404)
+    return user_feed(user)
+
+
+@event_bp.route('/calendar/reset', methods=['POST'])
+@login_required
+def reset_calendar_token():
+    """Replace the member's feed URL; the old one stops working."""
+    reset_feed_token(current_user)
+    flash("Új naptár-link készült, a régi már nem működik.", "success")
+    return redirect(url_for('events.events'))
+
+
+@event_bp.route('/calendar.ics')
+def public_calendar():
+    """Public iCalendar feed of the schedule.
+
+    Anonymous requests never write: recurring occurrences are created by
+    the members' pages and the daily scheduler job.
+    """
+    return public_feed()
+
+
+@event_bp.route('/events/stream')
+@login_required
+def seat_stream():
+    """Server-Sent Events with the free places of changed events.
+
+    ``since`` (or the ``Last-Event-ID`` of a reconnect) is the schedule
+    version the page was rendered with.  Answers 204, which tells the
+    browser not to reconnect, unless ``SSE_ENABLED`` is set.
+    """
+    if not current_app.config['SSE_ENABLED']:
+        return current_app.response_class(status=204)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        since = None
+    stream = seat_publisher().watch(since)
+    response = current_app.response_class(stream, mimetype='text/event-stream')
+    # Also runs when the client is gone before the stream was read.
+    response.call_on_close(stream.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep proxies such as nginx from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @event_bp.route('/events/signup/<int:event_id>')
 @login_required
 def signup(event_id):
     event = Event.query.get_or_404(event_id)
-    if event.spots_left <= 0:
+    result = register_for_event(event_id, current_user.id)
+    if result == FULL:
         flash('Nincs szabad hely.', 'danger')
-    elif EventRegistration.query.filter_by(event_id=event_id, user_id=current_user.id).first():
+    elif result == DUPLICATE:
         flash('Már jelentkeztél erre az eseményre.', 'warning')
     else:
-        reg = EventRegistration(event_id=event_id, user_id=current_user.id)
-        db.session.add(reg)
-        db.session.commit()
-        send_event_email(
-            'event_signup_user',
-            'Esemény jelentkezés',
-            event_signup_user_email(current_user.username, event),
-            current_user.email,
+        send_notification(
+            'event_signup_user', current_user.email, username=current_user.username, e=event
         )
         flash('Jelentkezés sikeres.', 'success')
     return redirect(url_for('events.events'))
@@ -93,15 +279,11 @@ def signup(event_id):
 @event_bp.route('/events/unregister/<int:event_id>')
 @login_required
 def unregister(event_id):
-    reg = EventRegistration.query.filter_by(event_id=event_id, user_id=current_user.id).first_or_404()
-    event = reg.event
-    db.session.delete(reg)
-    db.session.commit()
-    send_event_email(
-        'event_unregister_user',
-        'Esemény leiratkozás',
-        event_unregister_user_email(current_user.username, event),
-        current_user.email,
+    event = Event.query.get_or_404(event_id)
+    if not unregister_from_event(event_id, current_user.id):
+        abort(404)
+    send_notification(
+        'event_unregister_user', current_user.email, username=current_user.username, e=event
     )
     flash('Jelentkezés törölve.', 'success')
     return redirect(url_for('events.events'))
@@ -113,13 +295,13 @@ def admin_events():
     if current_user.role != 'admin':
         return redirect(url_for('events.events'))
     start, end = _get_two_week_range()
+    materialize_series()
     events = (
         Event.query.filter(Event.start_time >= start, Event.start_time <= end)
         .order_by(Event.start_time)
         .all()
     )
-    users = User.query.all()
-    return render_template('admin_events.html', events=events, users=users, start=start, end=end)
+    return render_template('admin_events.html', events=events, start=start, end=end)
 
 
 @event_bp.route('/admin/events/create', methods=['GET', 'POST'])
@@ -145,6 +327,94 @@ def create_event():
     return render_template('create_event.html', form=form)
 
 
+@event_bp.route('/admin/events/series')
+@login_required
+def series_list():
+    """List the recurring event series."""
+    if current_user.role != 'admin':
+        return redirect(url_for('events.events'))
+    series = EventSeries.query.order_by(EventSeries.weekday, EventSeries.start_time).all()
+    return render_template('event_series.html', series=series)
+
+
+def _series_form_error(form, start_date):
+    if form.end_time.data <= form.start_time.data:
+        return 'A befejezésnek a kezdés után kell lennie.'
+    if form.until.data < start_date:
+        return 'Az utolsó nap nem lehet az első nap előtt.'
+    return None
+
+
+@event_bp.route('/admin/events/series/create', methods=['GET', 'POST'])
+@login_required
+def create_event_series():
+    if current_user.role != 'admin':
+        return redirect(url_for('events.events'))
+    form = EventSeriesForm()
+    if request.method == 'GET':
+        form.start_date.data = datetime.now().date()
+    if form.validate_on_submit():
+        error = _series_form_error(form, form.start_date.data)
+        if error:
+            flash(error, 'danger')
+            return render_template('edit_event_series.html', form=form, series=None)
+        create_series(
+            name=form.name.data,
+            weekday=form.weekday.data,
+            start_time=form.start_time.data,
+            end_time=form.end_time.data,
+            capacity=form.capacity.data,
+            color=form.color.data,
+            start_date=form.start_date.data,
+            until=form.until.data,
+        )
+        flash('Ismétlődő esemény létrehozva.', 'success')
+        return redirect(url_for('events.series_list'))
+    return render_template('edit_event_series.html', form=form, series=None)
+
+
+@event_bp.route('/admin/events/series/<int:series_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_event_series(series_id):
+    """Edit a series together with all of its upcoming occurrences."""
+    if current_user.role != 'admin':
+        return redirect(url_for('events.events'))
+    series = EventSeries.query.get_or_404(series_id)
+    form = EventSeriesForm(obj=series)
+    # A different day or first day makes a different series.
+    del form.weekday
+    del form.start_date
+    if form.validate_on_submit():
+        error = _series_form_error(form, series.start_date)
+        if error:
+            flash(error, 'danger')
+            return render_template('edit_event_series.html', form=form, series=series)
+        changed = update_series(
+            series,
+            name=form.name.data,
+            start_time=form.start_time.data,
+            end_time=form.end_time.data,
+            capacity=form.capacity.data,
+            color=form.color.data,
+            until=form.until.data,
+        )
+        flash(f'Ismétlődő esemény frissítve ({changed} alkalom).', 'success')
+        return redirect(url_for('events.series_list'))
+    return render_template('edit_event_series.html', form=form, series=series)
+
+
+@event_bp.route('/admin/events/series/<int:series_id>/delete', methods=['POST'])
+@login_required
+def delete_event_series(series_id):
+    """Delete a series and its upcoming occurrences."""
+    if current_user.role != 'admin':
+        return redirect(url_for('events.events'))
+    series = EventSeries.query.get_or_404(series_id)
+    deleted = delete_series(series)
+    flash(f'Ismétlődő esemény törölve ({deleted} alkalom).', 'success')
+    return redirect(url_for('events.series_list'))
+
+
 @event_bp.route('/admin/events/<int:event_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_event(event_id):
@@ -169,8 +439,7 @@ def edit_event(event_id):
         flash('Esemény frissítve.', 'success')
         return redirect(url_for('events.admin_events'))
 
-    users = User.query.all()
-    return render_template('edit_event.html', form=form, event=event, users=users)
+    return render_template('edit_event.html', form=form, event=event)
 
 
 @event_bp.route('/admin/events/add_user/<int:event_id>', methods=['POST'])
@@ -180,23 +449,20 @@ def add_user(event_id):
         return redirect(url_for('events.events'))
     user_id = request.form.get('user_id', type=int)
     event = Event.query.get_or_404(event_id)
-    if event.spots_left <= 0:
-        flash('Nincs szabad hely.', 'danger')
-    elif EventRegistration.query.filter_by(event_id=event_id, user_id=user_id).first():
-        flash('A felhasználó már jelentkezett.', 'warning')
+    user = db.session.get(User, user_id) if user_id else None
+    if user is None:
+        flash('Nincs ilyen felhasználó.', 'danger')
     else:
-        reg = EventRegistration(event_id=event_id, user_id=user_id)
-        db.session.add(reg)
-        db.session.commit()
-        user = User.query.get(user_id)
-        if user:
-            send_event_email(
-                'event_signup_admin',
-                'Esemény jelentkezés',
-                event_signup_admin_email(user.username, event),
-                user.email,
+        result = register_for_event(event_id, user_id)
+        if result == FULL:
+            flash('Nincs szabad hely.', 'danger')
+        elif result == DUPLICATE:
+            flash('A felhasználó már jelentkezett.', 'warning')
+        else:
+            send_notification(
+                'event_signup_admin', user.email, username=user.username, e=event
             )
-        flash('Felhasználó hozzáadva.', 'success')
+            flash('Felhasználó hozzáadva.', 'success')
 
     next_page = request.args.get('next')
     if next_page == 'edit':
@@ -210,17 +476,13 @@ def remove_user(event_id, user_id):
     """Remove a user's registration from an event."""
     if current_user.role != 'admin':
         return redirect(url_for('events.events'))
-    reg = EventRegistration.query.filter_by(event_id=event_id, user_id=user_id).first_or_404()
-    event = reg.event
-    user = reg.user
-    db.session.delete(reg)
-    db.session.commit()
+    event = Event.query.get_or_404(event_id)
+    user = db.session.get(User, user_id)
+    if not unregister_from_event(event_id, user_id):
+        abort(404)
     if user:
-        send_event_email(
-            'event_unregister_admin',
-            'Esemény leiratkozás',
-            event_unregister_admin_email(user.username, event),
-            user.email,
+        send_notification(
+            'event_unregister_admin', user.email, username=user.username, e=event
         )
     flash('Felhasználó eltávolítva.', 'success')
     next_page = request.args.get('next')
@@ -229,6 +491,30 @@ def remove_user(event_id, user_id):
     return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
 
+@event_bp.route('/admin/events/checkin/<int:event_id>', methods=['POST'])
+@login_required
+def check_in_attendees(event_id):
+    """Use a pass of every participant of the event in one transaction."""
+    if current_user.role != 'admin':
+        return redirect(url_for('events.events'))
+    event = Event.query.get_or_404(event_id)
+    result = check_in_event(event.id)
+    if result.checked_in:
+        passes = (
+            Pass.query.options(joinedload(Pass.user))
+            .filter(Pass.id.in_([pass_id for pass_id, _ in result.checked_in]))
+            .all()
+        )
+        send_notifications('pass_used', [(p.user.email, {'p': p}) for p in passes])
+    flash(
+        f'{len(result.checked_in)} résztvevő bejelentkeztetve, '
+        f'{result.already} már rögzítve, '
+        f'{len(result.no_pass)} résztvevőnek nincs érvényes bérlete.',
+        'success' if not result.no_pass else 'warning',
+    )
+    return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
+
+
 @event_bp.route('/admin/events/delete/<int:event_id>', methods=['POST'])
 @login_required
 def delete_event(event_id):
@@ -1,16 +1,76 @@
-from flask import Blueprint, render_template, redirect, url_for, request
+from flask import Blueprint, render_template, redirect, url_for, request, Response, abort
 from flask_login import login_required, current_user
+from sqlalchemy.orm import contains_eager, selectinload
+from datetime import date
 from ..models import Pass, User, db
+from ..pass_codes import pass_qr_png
 
 user_bp = Blueprint('user', __name__)
 
+DASHBOARD_PAGE_SIZE = 30
+
+PASS_STATUS_FILTERS = {
+    'active': lambda today: (Pass.end_date >= today) & (Pass.used < Pass.total_uses),
+    'expired': lambda today: Pass.end_date < today,
+    'exhausted': lambda today: Pass.used >= Pass.total_uses,
+}
+
+
+def _admin_passes(filters, after):
+    """Return one page of passes (newest first) and the cursor of the next.
+
+    Pages are addressed by the id of the last pass shown (keyset
+    pagination), and owners are loaded in the same query, so every page
+    costs the same whatever the number of passes ever issued.
+    """
+    query = (
+        Pass.query.join(Pass.user)
+        .options(contains_eager(Pass.user))
+        .order_by(Pass.id.desc())
+    )
+    status = PASS_STATUS_FILTERS.get(filters['status'])
+    if status is not None:
+        query = query.filter(status(date.today()))
+    if filters['owner']:
+        query = query.filter(User.username.startswith(filters['owner'], autoescape=True))
+    if filters['type']:
+        query = query.filter(Pass.type == filters['type'])
+    if after:
+        query = query.filter(Pass.id < after)
+    passes = query.limit(DASHBOARD_PAGE_SIZE + 1).all()
+    next_after = None
+    if len(passes) > DASHBOARD_PAGE_SIZE:
+        passes = passes[:DASHBOARD_PAGE_SIZE]
+        next_after = passes[-1].id
+    return passes, next_after
+
+
 @user_bp.route('/dashboard')
 @login_required
 def dashboard():
     if current_user.role == 'admin':
-        passes = Pass.query.all()
-    else:
-        passes = Pass.query.filter_by(user_id=current_user.id).all()
+        filters = {
+            'status': request.args.get('status', ''),
+            'owner': request.args.get('owner', '').strip(),
+            'type': request.args.get('type', ''),
+        }
+        passes, next_after = _admin_passes(filters, request.args.get('after', type=int))
+        types = db.session.execute(
+            db.select(Pass.type).distinct().order_by(Pass.type)
+        ).scalars().all()
+        return render_template(
+            'dashboard.html',
+            passes=passes,
+            user=current_user,
+            filters=filters,
+            types=types,
+            next_after=next_after,
+        )
+    passes = (
+        Pass.query.filter_by(user_id=current_user.id)
+        .options(selectinload(Pass.usages))
+        .all()
+    )
     return render_template('dashboard.html', passes=passes, user=current_user)
 
 
@@ -21,3 +81,16 @@ def toggle_reminder():
     db.session.commit()
     next_url = request.referrer or url_for('user.dashboard')
     return redirect(next_url)
+
+
+@user_bp.route('/pass/<int:pass_id>/qr.png')
+@login_required
+def pass_qr(pass_id):
+    """Serve the check-in QR code of a pass to its owner or an admin."""
+    p = db.session.get(Pass, pass_id)
+    if p is None or (current_user.role != 'admin' and p.user_id != current_user.id):
+        abort(404)
+    response = Response(pass_qr_png(p), mimetype='image/png')
+    # Links carry ``qr_version`` (``?v=``), so a new code gets a new URL.
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,124 @@
+"""Schedule version counter and the calendar fragment cache.
+
+The shared part of the ``/events`` grid is identical for every member until
+an event or registration changes.  :func:`current_schedule_version` reads a
+counter that is bumped in the same transaction as every such change (the
+changed events remember it in ``Event.version``), and rendered grids are
+cached under ``(window start, version)``.  Only the per-user
+signup/unregister links are rendered on each request; participant lists
+are fetched by the popovers and cached under ``Event.version``.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, insert, text, update
+from sqlalchemy.orm import Session
+
+from .models import DeletedEvent, Event, EventRegistration, ScheduleVersion, db
+
+_TRACKED = (Event, EventRegistration)
+_ACTIONS_MARKER = re.compile(r"<!--actions:(\d+)-->")
+
+
+def current_schedule_version() -> int:
+    version = db.session.execute(
+        db.select(ScheduleVersion.version).where(ScheduleVersion.id == 1)
+    ).scalar()
+    return version or 0
+
+
+def bump_schedule_version(connection, event_ids=None):
+    """Increment the schedule version using ``connection`` and return it.
+
+    The events in ``event_ids`` (ids or a ``SELECT`` of ids) are stamped
+    with the new version in ``Event.version``; deleted events need a
+    ``DeletedEvent`` row with it.  Called automatically for
+    ORM flushes; bulk ``UPDATE``/``DELETE`` statements that bypass the unit
+    of work must call it themselves.
+    """
+    version = connection.execute(
+        text("UPDATE schedule_version SET version = version + 1 WHERE id = 1 RETURNING version")
+    ).scalar()
+    if event_ids is not None:
+        connection.execute(
+            update(Event).where(Event.id.in_(event_ids)).values(version=version)
+        )
+    return version
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_schedule_change(session, flush_context):
+    touched, changed, deleted = False, set(), []
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _TRACKED) and (
+            obj in session.new or obj in session.deleted or session.is_modified(obj)
+        ):
+            touched = True
+            if isinstance(obj, EventRegistration):
+                changed.add(obj.event_id)
+            elif obj in session.deleted:
+                deleted.append({'event_id': obj.id})
+            else:
+                changed.add(obj.id)
+    if touched:
+        version = bump_schedule_version(session.connection(), sorted(changed))
+        if deleted:
+            session.connection().execute(insert(DeletedEvent).values(version=version), deleted)
+
+
+class FragmentCache:
+    """Small thread-safe LRU cache for rendered HTML fragments."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CalendarGrid:
+    """A rendered calendar grid with slots for the per-user links.
+
+    ``parts`` alternates static HTML and event ids; ``spots_left`` maps
+    event ids to the free places at render time.
+    """
+
+    __slots__ = ('parts', 'spots_left')
+
+    def __init__(self, html, spots_left):
+        self.parts = _ACTIONS_MARKER.split(html)
+        self.spots_left = spots_left
+
+    def render(self, actions):
+        """Return the grid HTML with ``actions(event_id)`` filled into each slot."""
+        parts = self.parts
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            out.append(actions(int(parts[i])))
+            out.append(parts[i + 1])
+        return "".join(out)
+
+
+grid_cache = FragmentCache()
+# Participant lists of the calendar popovers, keyed by their ETag (restore
+# generation, event id and version).
+participants_cache = FragmentCache(maxsize=512)
@@ -0,0 +1,101 @@
+"""JSON view of the schedule for the front-end and kiosk displays.
+
+:func:`schedule_payload` returns the events of a date window with their
+free places and whether the caller signed up, in one indexed query.  The
+response carries the schedule version; clients pass it back as
+``since=<version>`` to receive only the events whose ``Event.version`` is
+newer, plus the ids of events deleted (``DeletedEvent``) or moved out of
+the window since.  A ``since`` newer than the current version (e.g. after
+a database restore) is answered with the full window and ``"delta":
+false``.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, select
+
+from .models import DeletedEvent, Event, EventRegistration, db
+
+DEFAULT_DAYS = 14
+MAX_DAYS = 92
+
+
+def parse_window(start, end):
+    """Return ``(first_day, last_day)`` for ``YYYY-MM-DD`` strings.
+
+    Defaults to the two weeks from today.  Raises ``ValueError`` for bad
+    dates and windows longer than ``MAX_DAYS``.
+    """
+    first = date.fromisoformat(start) if start else date.today()
+    last = date.fromisoformat(end) if end else first + timedelta(days=DEFAULT_DAYS - 1)
+    if last < first or (last - first).days >= MAX_DAYS:
+        raise ValueError('invalid window')
+    return first, last
+
+
+def _bounds(first, last):
+    return (
+        datetime.combine(first, time.min),
+        datetime.combine(last + timedelta(days=1), time.min),
+    )
+
+
+def _event_json(e, registered):
+    return {
+        'id': e.id,
+        'name': e.name,
+        'start': e.start_time.isoformat(timespec='minutes'),
+        'end': e.end_time.isoformat(timespec='minutes'),
+        'capacity': e.capacity,
+        'spots_left': e.spots_left,
+        'color': e.color_hex,
+        'registered': bool(registered),
+        'version': e.version,
+    }
+
+
+def schedule_payload(user_id, first, last, version, since=None):
+    """Return the JSON-ready schedule of ``first``..``last`` for ``user_id``.
+
+    ``version`` is the current schedule version.  With ``since`` only the
+    events changed after that version are listed, and ``removed`` holds the
+    ids of events deleted or moved out of the window since then.
+    """
+    lower, upper = _bounds(first, last)
+    delta = since is not None and since <= version
+    statement = (
+        select(Event, EventRegistration.id.is_not(None))
+        .outerjoin(
+            EventRegistration,
+            and_(
+                EventRegistration.event_id == Event.id,
+                EventRegistration.user_id == user_id,
+            ),
+        )
+        .order_by(Event.start_time)
+    )
+    if delta:
+        # Changed events are few; they are read regardless of the window
+        # so events moved out of it can be reported as removed.
+        statement = statement.where(Event.version > since)
+    else:
+        statement = statement.where(Event.start_time >= lower, Event.start_time < upper)
+    events, removed = [], []
+    for e, registered in db.session.execute(statement):
+        if lower <= e.start_time < upper:
+            events.append(_event_json(e, registered))
+        else:
+            removed.append(e.id)
+    payload = {
+        'version': version,
+        'start': first.isoformat(),
+        'end': last.isoformat(),
+        'delta': delta,
+        'events': events,
+    }
+    if delta:
+        removed.extend(db.session.execute(
+            select(DeletedEvent.event_id).where(DeletedEvent.version > since)
+        ).scalars())
+        payload['removed'] = removed
+    return payload
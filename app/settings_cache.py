@@ -0,0 +1,57 @@
+"""Process-local, read-only cache of the ``EmailSettings`` row.
+
+Every notification needs the email settings, so loading the row for each
+message is wasteful.  :func:`get_email_settings` returns an immutable
+snapshot which is reloaded at most once per ``EMAIL_SETTINGS_TTL`` seconds.
+Code that changes the row in this process calls
+:func:`invalidate_email_settings`; other worker processes pick the change
+up when their snapshot expires.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+from .models import EmailSettings
+
+EmailSettingsSnapshot = namedtuple(
+    'EmailSettingsSnapshot', [column.name for column in EmailSettings.__table__.columns]
+)
+
+_MISSING = object()
+_lock = threading.Lock()
+_snapshot = _MISSING
+_loaded_at = 0.0
+
+
+def get_email_settings():
+    """Return an ``EmailSettingsSnapshot`` or ``None`` if no row exists."""
+    global _snapshot, _loaded_at
+    ttl = current_app.config.get('EMAIL_SETTINGS_TTL', 30)
+    snapshot = _snapshot
+    if snapshot is not _MISSING and time.monotonic() - _loaded_at < ttl:
+        return snapshot
+    with _lock:
+        if _snapshot is _MISSING or time.monotonic() - _loaded_at >= ttl:
+            row = EmailSettings.query.first()
+            _snapshot = (
+                EmailSettingsSnapshot(
+                    *(getattr(row, field) for field in EmailSettingsSnapshot._fields)
+                )
+                if row
+                else None
+            )
+            _loaded_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate_email_settings():
+    """Drop the cached snapshot so the next read reloads it."""
+    global _snapshot
+    # A plain assignment without ``_lock``: this also runs from the pool
+    # checkout hook of ``app.restore``, possibly while the loader above holds
+    # the lock and is waiting for its connection.
+    _snapshot = _MISSING
+
@@ -0,0 +1,59 @@
+"""Per-connection SQLite settings for running under several workers.
+
+With the default rollback journal a writer blocks every reader and
+concurrent requests fail with "database is locked".  The ``production``
+profile switches to WAL (readers and one writer proceed concurrently),
+waits for locks instead of failing immediately and enables foreign key
+enforcement.  The profile is chosen with ``SQLITE_PROFILE`` and single
+pragmas can be overridden with ``SQLITE_<PRAGMA>`` environment variables,
+e.g. ``SQLITE_BUSY_TIMEOUT=10000``; an empty value disables a pragma.
+"""
+
+import os
+
+from sqlalchemy import event
+
+PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'foreign_keys': 'ON',
+    },
+}
+
+PRAGMAS = ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size', 'foreign_keys')
+
+
+def pragmas_from_env(environ=os.environ):
+    """Return the pragmas selected by the ``SQLITE_*`` environment variables."""
+    profile = environ.get('SQLITE_PROFILE', 'production')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {profile!r}")
+    pragmas = dict(PROFILES[profile])
+    for name in PRAGMAS:
+        value = environ.get(f'SQLITE_{name.upper()}')
+        if value is None:
+            continue
+        if value == '':
+            pragmas.pop(name, None)
+        else:
+            pragmas[name] = value
+    return pragmas
+
+
+def configure_sqlite(engine, pragmas):
+    """Run ``pragmas`` on every new DB-API connection made by ``engine``."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
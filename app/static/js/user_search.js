@@ -0,0 +1,39 @@
+// Autocomplete for member pickers: queries admin.search_users as the admin
+// types and stores the chosen member's id in the linked hidden input.
+document.querySelectorAll('[data-user-search]').forEach(function (input) {
+    var hidden = document.getElementById(input.dataset.userSearch);
+    var list = document.getElementById(input.getAttribute('list'));
+    var results = {};
+    var timer;
+
+    input.addEventListener('input', function () {
+        var label = input.value.trim();
+        if (Object.prototype.hasOwnProperty.call(results, label)) {
+            hidden.value = results[label];
+            return;
+        }
+        hidden.value = '';
+        clearTimeout(timer);
+        if (!label) {
+            return;
+        }
+        timer = setTimeout(function () {
+            fetch(input.dataset.searchUrl + '?q=' + encodeURIComponent(label))
+                .then(function (response) { return response.json(); })
+                .then(function (users) {
+                    results = {};
+                    list.innerHTML = '';
+                    users.forEach(function (u) {
+                        var text = u.username + ' (' + u.email + ')';
+                        var option = document.createElement('option');
+                        results[text] = u.id;
+                        option.value = text;
+                        list.appendChild(option);
+                    });
+                    if (Object.prototype.hasOwnProperty.call(results, input.value.trim())) {
+                        hidden.value = results[input.value.trim()];
+                    }
+                });
+        }, 200);
+    });
+});
@@ -1,15 +1,15 @@
 import qrcode
 import io
 import base64
-import smtplib
-from email.message import EmailMessage
-import os
-import logging
-import re
-from .email_templates import base_email_template
-from .models import EmailSettings, User, db
-
-def generate_qr_code(data: str) -> str:
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from .email_templates import base_email_template, compiled_templates
+from .mailer import enqueue_email, enqueue_emails, send_bulk
+from .models import OutboxEmail, ReminderRun, User, db
+from .settings_cache import get_email_settings
+
+def qr_png(data: str) -> bytes:
     qr = qrcode.QRCode(version=1, box_size=6, border=2)
     qr.add_data(data)
     qr.make(fit=True)
@@ -17,104 +17,181 @@ def generate_qr_code(data: str) -> str:
     img = qr.make_image(fill_color="black", back_color="white")
     buf = io.BytesIO()
     img.save(buf, format="PNG")
-    qr_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+    return buf.getvalue()
+
+
+def generate_qr_code(data: str) -> str:
+    qr_base64 = base64.b64encode(qr_png(data)).decode('utf-8')
 
     return f"data:image/png;base64,{qr_base64}"
 
+USER_SEARCH_LIMIT = 20
+
+
+def search_users(term, limit=USER_SEARCH_LIMIT):
+    """Return up to ``limit`` users whose username or email starts with ``term``.
+
+    Matching is case-insensitive and runs as range scans on the ``lower()``
+    expression indexes of ``User``.  An exact username match comes first,
+    then username matches before email matches, shorter names first.
+    Rows are ``(id, username, email)`` tuples.
+    """
+    term = term.strip().lower()
+    if not term:
+        return []
+    upper = term + '\U0010ffff'
+    found = {}
+    for rank, column in ((0, func.lower(User.username)), (1, func.lower(User.email))):
+        rows = db.session.execute(
+            select(User.id, User.username, User.email)
+            .where(column >= term, column < upper)
+            .order_by(column)
+            .limit(limit)
+        )
+        for row in rows:
+            found.setdefault(row.id, (rank, row))
+
+    def relevance(item):
+        rank, row = item
+        name = row.username.lower()
+        return (name != term, rank, len(name), name)
+
+    return [row for _, row in sorted(found.values(), key=relevance)[:limit]]
+
+
 def send_email(subject, html_content, to_email):
-    """Send an email if credentials are configured.
+    """Queue an email for delivery by the background outbox workers.
 
-    The function logs any exception and returns ``True`` on success and
-    ``False`` if the email could not be sent. This prevents unexpected
-    server errors when email credentials are missing or invalid.
+    Delivery (and any SMTP error) happens outside the request, see
+    :mod:`app.mailer`.  Returns ``True`` once the message has been queued.
     """
+    enqueue_email(subject, html_content, to_email)
+    return True
 
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    settings = EmailSettings.query.first()
-    email_from = os.getenv('EMAIL_FROM')
-    email_password = os.getenv('EMAIL_PASSWORD')
-    if settings:
-        if settings.email_from:
-            email_from = settings.email_from
-        if settings.email_password:
-            email_password = settings.email_password
-
-    msg['From'] = email_from
-    msg['To'] = to_email
-    msg.set_content("Ez egy HTML formátumú e-mail.")
-    msg.add_alternative(html_content, subtype='html')
-
-    if not email_from or not email_password:
-        logging.error('Email credentials are not configured.')
-        return False
 
-    try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(email_from, email_password)
-            smtp.send_message(msg)
-        return True
-    except Exception as exc:
-        logging.error('Failed to send email: %s', exc)
+def send_notification(event, to_email, **context):
+    """Queue the registered notification ``event`` for ``to_email``.
+
+    ``context`` is passed to the template body, see
+    :data:`app.email_templates.EMAIL_TEMPLATES`.  Returns ``False`` when the
+    notification is disabled in the email settings.
+    """
+    template = compiled_templates(get_email_settings())[event]
+    if not template.enabled:
         return False
+    return send_email(template.subject, template.render(**context), to_email)
+
+
+def send_notifications(event, recipients):
+    """Queue notification ``event`` for many ``(to_email, context)`` pairs at once.
+
+    All messages are inserted into the outbox in one transaction.  Returns
+    the number of queued messages (``0`` when the notification is disabled).
+    """
+    template = compiled_templates(get_email_settings())[event]
+    if not template.enabled:
+        return 0
+    return enqueue_emails(
+        (template.subject, template.render(**context), to_email)
+        for to_email, context in recipients
+    )
+
+
+def _reminder_chunks(after_id, chunk_size):
+    """Yield opted-in ``(id, email)`` rows in keyset-paginated chunks."""
+    while True:
+        rows = db.session.execute(
+            select(User.id, User.email)
+            .where(User.weekly_reminder_opt_in.is_(True), User.id > after_id)
+            .order_by(User.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
 
 
-def send_event_email(event, subject, default_html, to_email):
-    settings = EmailSettings.query.first()
-
-    def _extract_content(html: str) -> str:
-        """Return the text content from a ``base_email_template`` HTML string."""
-        match = re.search(r"<p[^>]*>(.*?)</p>", html, re.DOTALL)
-        return match.group(1) if match else ""
-
-    default_content = _extract_content(default_html)
-
-    if settings:
-        mapping = {
-            'user_created': (settings.user_created_enabled, settings.user_created_text),
-            'user_deleted': (settings.user_deleted_enabled, settings.user_deleted_text),
-            'pass_created': (settings.pass_created_enabled, settings.pass_created_text),
-            'pass_deleted': (settings.pass_deleted_enabled, settings.pass_deleted_text),
-            'pass_used': (settings.pass_used_enabled, settings.pass_used_text),
-            'event_signup_user': (
-                settings.event_signup_user_enabled,
-                settings.event_signup_user_text,
-            ),
-            'event_signup_admin': (
-                settings.event_signup_admin_enabled,
-                settings.event_signup_admin_text,
-            ),
-            'event_unregister_user': (
-                settings.event_unregister_user_enabled,
-                settings.event_unregister_user_text,
-            ),
-            'event_unregister_admin': (
-                settings.event_unregister_admin_enabled,
-                settings.event_unregister_admin_text,
-            ),
-        }
-        enabled, custom_text = mapping.get(event, (False, None))
-        if not enabled:
-            return False
-        if custom_text:
-            combined = f"{custom_text}<br><br>{default_content}"
-            html = base_email_template(subject, combined)
-        else:
-            html = default_html
-    else:
-        html = default_html
-
-    return send_email(subject, html, to_email)
-
-
-def send_weekly_reminders(app):
-    """Send weekly reminder emails to opted-in users."""
+def _acquire_reminder_run(run_key, lease):
+    """Return the ``ReminderRun`` for ``run_key`` if this process may deliver it.
+
+    The run row is created on first use; delivery is guarded by a lease so
+    only one scheduler instance sends at a time, while a crashed sender's
+    run is taken over once its lease expires.
+    """
+    if not ReminderRun.query.filter_by(run_key=run_key).first():
+        db.session.add(ReminderRun(run_key=run_key))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ReminderRun)
+        .where(
+            ReminderRun.run_key == run_key,
+            ReminderRun.finished_at.is_(None),
+            or_(ReminderRun.locked_until.is_(None), ReminderRun.locked_until < now),
+        )
+        .values(locked_until=now + timedelta(seconds=lease))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    return ReminderRun.query.filter_by(run_key=run_key).first()
+
+
+def send_weekly_reminders(app, run_key=None):
+    """Send weekly reminder emails to opted-in users.
+
+    Recipients are streamed in chunks and delivered by
+    :func:`app.mailer.send_bulk`.  Progress is stored in ``ReminderRun``
+    (keyed by ISO week unless ``run_key`` is given) after every chunk, so
+    a run interrupted by a crash continues where it stopped; at most the
+    chunk that was in flight is delivered again.
+    """
     with app.app_context():
-        settings = EmailSettings.query.first()
+        settings = get_email_settings()
         if not settings or not settings.weekly_reminder_enabled:
             return
         text = settings.weekly_reminder_text or "Emlékeztető"
         html = base_email_template("Heti emlékeztető", text)
-        recipients = User.query.filter_by(weekly_reminder_opt_in=True).all()
-        for user in recipients:
-            send_email("Heti emlékeztető", html, user.email)
+
+        if run_key is None:
+            year, week, _ = date.today().isocalendar()
+            run_key = f"{year}-W{week:02d}"
+        lease = app.config['REMINDER_LEASE_SECONDS']
+        run = _acquire_reminder_run(run_key, lease)
+        if run is None:
+            return
+
+        batch_size = app.config['REMINDER_BATCH_SIZE']
+        senders = app.config['REMINDER_SENDERS']
+
+        def checkpoint(last_user_id, sent, failed):
+            # Hand undeliverable addresses to the outbox so they are retried
+            # with backoff instead of being lost or resending the chunk.
+            for to_email in failed:
+                db.session.add(
+                    OutboxEmail(subject="Heti emlékeztető", html=html, to_email=to_email)
+                )
+            run.last_user_id = last_user_id
+            run.sent_count += sent
+            run.failed_count += len(failed)
+            run.locked_until = datetime.utcnow() + timedelta(seconds=lease)
+            db.session.commit()
+
+        delivered = send_bulk(
+            "Heti emlékeztető",
+            html,
+            _reminder_chunks(run.last_user_id, batch_size * senders),
+            batch_size=batch_size,
+            senders=senders,
+            rate=app.config['REMINDER_RATE_LIMIT'],
+            on_chunk=checkpoint,
+        )
+        run.locked_until = None
+        if delivered:
+            run.finished_at = datetime.utcnow()
+        db.session.commit()
@@ -0,0 +1,94 @@
+"""Size and render time of the /events page for a full schedule.
+
+Seeds a throw-away SQLite database with ``--per-day`` events a day for the
+two-week window, each ``--hours`` hours long, and fills every event to its
+``--capacity`` with members drawn from ``--members``.  Then fetches
+``/events`` as a member, once with a cold grid cache and ``--repeat`` times
+warm, and prints the page size (raw and gzip) and the timings.
+
+Run from the repository root::
+
+    python benchmarks/bench_calendar_page.py
+"""
+
+import argparse
+import gzip
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-day', type=int, default=8)
+    parser.add_argument('--hours', type=float, default=1.5)
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--members', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'page.db')
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from sqlalchemy import insert
+
+    from app import create_app, db
+    from app.models import Event, EventRegistration, User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        member = User(username='member', email='member@example.com')
+        member.set_password('member')
+        db.session.add(member)
+        # Random names so gzip cannot fold the rosters away.
+        rng = random.Random(1)
+        db.session.execute(insert(User), [
+            {'username': ''.join(rng.choices(string.ascii_lowercase, k=12)),
+             'email': f'tag{i}@example.com', 'password_hash': 'x'}
+            for i in range(args.members)
+        ])
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        events = []
+        for day in range(14):
+            for slot in range(args.per_day):
+                start = today + timedelta(days=day, hours=7 + slot * 1.75)
+                events.append({
+                    'name': f'Óra {day}-{slot}',
+                    'start_time': start,
+                    'end_time': start + timedelta(hours=args.hours),
+                    'capacity': args.capacity,
+                    'registered_count': args.capacity,
+                })
+        db.session.execute(insert(Event), events)
+        event_ids = db.session.execute(db.select(Event.id)).scalars().all()
+        db.session.execute(insert(EventRegistration), [
+            {'event_id': event_id, 'user_id': user_id}
+            for event_id in event_ids
+            for user_id in rng.sample(range(2, args.members + 2), args.capacity)
+        ])
+        db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'member', 'password': 'member'})
+    started = time.perf_counter()
+    body = client.get('/events').data
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        client.get('/events')
+    warm = (time.perf_counter() - started) / args.repeat
+    print(f"{len(event_ids)} events x {args.capacity} participants, {args.hours}h each")
+    print(f"/events: {len(body) / 1024:.1f} KiB ({len(gzip.compress(body)) / 1024:.1f} KiB gzip), "
+          f"cold {cold * 1000:.0f} ms, warm {warm * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Compare notification rendering before and after the template registry.
+
+``legacy_render`` reproduces the former ``send_event_email`` flow: render
+the full HTML with the ``*_email`` helper, build the settings mapping and
+regex the ``<p>`` body back out to wrap it with the custom text.  The
+registry path renders a precompiled template directly.
+
+Run from the repository root::
+
+    python benchmarks/bench_email_templates.py
+"""
+
+import os
+import re
+import sys
+import timeit
+from datetime import date, datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.email_templates import (  # noqa: E402
+    base_email_template,
+    compiled_templates,
+    event_signup_user_email,
+    pass_used_email,
+)
+from app.settings_cache import EmailSettingsSnapshot  # noqa: E402
+
+
+def legacy_render(settings, event, subject, default_html):
+    def _extract_content(html):
+        match = re.search(r"<p[^>]*>(.*?)</p>", html, re.DOTALL)
+        return match.group(1) if match else ""
+
+    default_content = _extract_content(default_html)
+    mapping = {
+        'user_created': (settings.user_created_enabled, settings.user_created_text),
+        'user_deleted': (settings.user_deleted_enabled, settings.user_deleted_text),
+        'pass_created': (settings.pass_created_enabled, settings.pass_created_text),
+        'pass_deleted': (settings.pass_deleted_enabled, settings.pass_deleted_text),
+        'pass_used': (settings.pass_used_enabled, settings.pass_used_text),
+        'event_signup_user': (
+            settings.event_signup_user_enabled,
+            settings.event_signup_user_text,
+        ),
+        'event_signup_admin': (
+            settings.event_signup_admin_enabled,
+            settings.event_signup_admin_text,
+        ),
+        'event_unregister_user': (
+            settings.event_unregister_user_enabled,
+            settings.event_unregister_user_text,
+        ),
+        'event_unregister_admin': (
+            settings.event_unregister_admin_enabled,
+            settings.event_unregister_admin_text,
+        ),
+    }
+    enabled, custom_text = mapping.get(event, (False, None))
+    if not enabled:
+        return None
+    if custom_text:
+        return base_email_template(subject, f"{custom_text}<br><br>{default_content}")
+    return default_html
+
+
+def main(number=20000):
+    values = {field: None for field in EmailSettingsSnapshot._fields}
+    values.update(
+        pass_used_enabled=True,
+        pass_used_text="Köszönjük, hogy nálunk edzel!",
+        event_signup_user_enabled=True,
+    )
+    settings = EmailSettingsSnapshot(**values)
+    user = SimpleNamespace(username='kovacs.anna')
+    p = SimpleNamespace(
+        type='10 alkalmas', start_date=date(2026, 1, 1), end_date=date(2026, 3, 1),
+        used=3, total_uses=10, comment='Reggeli csoport', user=user,
+    )
+    e = SimpleNamespace(
+        name='Kettlebell', formatted_time='2026-01-05 Hétfő 18:00 - 19:00',
+        start_time=datetime(2026, 1, 5, 18),
+    )
+
+    cases = [
+        ('pass_used (custom text)', 'pass_used', "Bérlet használat",
+         lambda: pass_used_email(p), {'p': p}),
+        ('event_signup_user', 'event_signup_user', "Esemény jelentkezés",
+         lambda: event_signup_user_email(user.username, e), {'username': user.username, 'e': e}),
+    ]
+    for label, event, subject, default, context in cases:
+        expected = legacy_render(settings, event, subject, default())
+        template = compiled_templates(settings)[event]
+        assert template.render(**context) == expected, label
+
+        legacy = timeit.timeit(
+            lambda: legacy_render(settings, event, subject, default()), number=number
+        )
+        registry = timeit.timeit(
+            lambda: compiled_templates(settings)[event].render(**context), number=number
+        )
+        print(
+            f"{label:26} legacy {number / legacy:10.0f}/s   "
+            f"registry {number / registry:10.0f}/s   speedup {legacy / registry:4.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Time the phases of a CSV member import.
+
+Generates a CSV of ``--rows`` members (a few of them invalid or already
+existing), then times parsing, the set-based uniqueness check and the
+background insert of :mod:`app.member_import` on a throw-away SQLite
+database.  Real scrypt hashing of 10k passwords takes minutes per CPU, so
+by default the import runs with a cheap hash to measure everything else,
+and the scrypt throughput of the hashing pool is measured separately on
+``--hash-sample`` passwords.  ``--real-hash`` imports with scrypt.
+
+Run from the repository root::
+
+    python benchmarks/bench_member_import.py --rows 10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def _csv(rows):
+    lines = ['username;email;password;role']
+    for i in range(rows):
+        if i % 1000 == 1:
+            lines.append(f'bad{i};not-an-email;;')
+        elif i % 1000 == 2:
+            lines.append('existing;existing@example.com;;')
+        else:
+            lines.append(f'member{i};member{i}@example.com;pw{i};user')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--hash-sample', type=int, default=40)
+    parser.add_argument('--real-hash', action='store_true')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'import.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from werkzeug.security import generate_password_hash
+
+    from app import create_app, db
+    from app import member_import
+    from app.models import MemberImport, OutboxEmail, User
+
+    app = create_app()
+    workers = app.config['IMPORT_HASH_WORKERS'] or os.cpu_count() or 1
+    with app.app_context():
+        existing = User(username='existing', email='existing@example.com', role='user')
+        existing.set_password('x')
+        db.session.add(existing)
+        db.session.commit()
+
+        data = _csv(args.rows)
+        started = time.perf_counter()
+        rows, errors = member_import.parse_members(member_import.decode_upload(data))
+        parsed = time.perf_counter()
+        rows = member_import.drop_taken(rows, errors)
+        checked = time.perf_counter()
+        job = MemberImport(
+            filename='bench.csv', total=len(rows) + len(errors), errors=json.dumps(errors)
+        )
+        db.session.add(job)
+        db.session.commit()
+        import_id = job.id
+
+    if not args.real_hash:
+        member_import.generate_password_hash = partial(
+            generate_password_hash, method='pbkdf2:sha256:1'
+        )
+    started_import = time.perf_counter()
+    member_import.run_import(app, import_id, rows)
+    imported = time.perf_counter()
+
+    with app.app_context():
+        job = db.session.get(MemberImport, import_id)
+        users = User.query.count()
+        queued = OutboxEmail.query.count()
+        print(f"parse {parsed - started:.3f}s, uniqueness check {checked - parsed:.3f}s, "
+              f"import {imported - started_import:.2f}s "
+              f"({'scrypt' if args.real_hash else 'cheap hash'}, {workers} hashing threads)")
+        print(f"{job.imported} imported, {len(json.loads(job.errors))} row errors, "
+              f"{users} users, {queued} queued welcome emails")
+
+    sample = [f'pw{i}' for i in range(args.hash_sample)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(generate_password_hash, sample))
+    per_hash = (time.perf_counter() - started) / len(sample)
+    print(f"scrypt: {1 / per_hash:.1f} hashes/s with {workers} threads, "
+          f"~{per_hash * args.rows:.0f}s for {args.rows} passwords")
+
+
+if __name__ == '__main__':
+    main()
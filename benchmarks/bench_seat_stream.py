@@ -0,0 +1,178 @@
+"""Fan-out latency and idle cost of the live seat stream.
+
+Serves the app with a threaded werkzeug server on a throw-away SQLite
+database, opens ``--watchers`` ``/events/stream`` connections as a logged
+in member and reads them from one selector thread.  It then measures:
+
+* the CPU time the whole process spends over ``--idle`` seconds with every
+  watcher connected and nothing changing;
+* the time until every watcher has received a signup made through the app
+  (woken directly by the publisher);
+* the same for a signup committed by a separate process, i.e. another
+  worker, which is only seen through polling the schedule version.
+
+Run from the repository root::
+
+    python benchmarks/bench_seat_stream.py --watchers 500
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def _app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['SSE_ENABLED'] = '1'
+    from app import create_app
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def _other_worker(db_path, event_id, user_id, committed):
+    app = _app(db_path)
+    from app.registrations import register_for_event
+
+    with app.app_context():
+        register_for_event(event_id, user_id)
+    committed.put(time.time())
+
+
+def _request(port, method, path, cookie=None, body=b''):
+    sock = socket.create_connection(('127.0.0.1', port))
+    headers = [f'{method} {path} HTTP/1.1', 'Host: localhost', f'Content-Length: {len(body)}']
+    if cookie:
+        headers.append(f'Cookie: {cookie}')
+    if body:
+        headers.append('Content-Type: application/x-www-form-urlencoded')
+    sock.sendall(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+    return sock
+
+
+def _login(port, username):
+    sock = _request(port, 'POST', '/login', body=f'username={username}&password=pw'.encode())
+    head = sock.recv(65536).decode('latin-1')
+    sock.close()
+    for line in head.split('\r\n'):
+        if line.lower().startswith('set-cookie: session='):
+            return line.split(': ', 1)[1].split(';', 1)[0]
+    raise SystemExit(f'login of {username} failed')
+
+
+class Watchers:
+    """Reads every stream in one thread and counts delivered messages."""
+
+    def __init__(self, socks):
+        self.selector = selectors.DefaultSelector()
+        self.received = {sock: 0 for sock in socks}
+        for sock in socks:
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                self.received[key.fileobj] += data.count(b'\ndata: {"version"')
+
+    def wait_all(self, count, timeout=30):
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            if all(n >= count for n in self.received.values()):
+                self.done_at = time.time()
+                return time.perf_counter() - started
+            time.sleep(0.002)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--watchers', type=int, default=500)
+    parser.add_argument('--idle', type=float, default=5.0)
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'seats.db')
+    app = _app(db_path)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from werkzeug.serving import ThreadedWSGIServer, make_server
+
+    from app import db
+    from app.models import Event, User
+
+    with app.app_context():
+        users = []
+        for name in ('watcher', 'local', 'remote'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('pw')
+            users.append(user)
+        start = datetime.now() + timedelta(days=1)
+        event = Event(name='Spinning', start_time=start, end_time=start + timedelta(hours=1),
+                      capacity=10)
+        db.session.add_all([*users, event])
+        db.session.commit()
+        event_id, remote_id = event.id, users[2].id
+
+    # Room for every watcher connecting at once.
+    ThreadedWSGIServer.request_queue_size = 1024
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    cookie = _login(port, 'watcher')
+    socks = [_request(port, 'GET', '/events/stream', cookie) for _ in range(args.watchers)]
+    watchers = Watchers(socks)
+    time.sleep(2)
+
+    cpu = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu
+    print(f"{args.watchers} idle watchers: {idle_cpu * 1000:.0f} ms CPU in {args.idle:.0f}s "
+          f"({threading.active_count()} threads)")
+
+    local = _login(port, 'local')
+    _request(port, 'GET', f'/events/signup/{event_id}', local).close()
+    waited = watchers.wait_all(1)
+    print(f"local signup reached all watchers "
+          f"{'never' if waited is None else f'in {waited * 1000:.0f} ms'}")
+
+    ctx = multiprocessing.get_context('spawn')
+    committed = ctx.Queue()
+    proc = ctx.Process(target=_other_worker, args=(db_path, event_id, remote_id, committed))
+    proc.start()
+    waited = watchers.wait_all(2, timeout=60)
+    commit_time = committed.get()
+    proc.join()
+    latency = 'never' if waited is None else (
+        f'{(watchers.done_at - commit_time) * 1000:.0f} ms after its commit'
+    )
+    print(f"signup in another process reached all watchers {latency} "
+          f"(poll interval {app.config['SSE_POLL_INTERVAL']}s)")
+    ok = all(n == 2 for n in watchers.received.values())
+    print('OK' if ok else f'FAILED {sorted(set(watchers.received.values()))}')
+    os._exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Mixed read/write load against SQLite with and without the production profile.
+
+Writer processes repeatedly do what ``admin.use_pass`` does (increment
+``Pass.used``, insert a ``PassUsage``, commit) while reader processes run
+the ``/events`` calendar queries.  Each profile gets a fresh database and
+the same duration; the script reports completed operations per second and
+the number of operations that failed with "database is locked".
+
+Run from the repository root::
+
+    python benchmarks/bench_sqlite_concurrency.py --writers 4 --readers 8 --seconds 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def _app(db_path, profile):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['SQLITE_PROFILE'] = profile
+    from app import create_app
+
+    return create_app()
+
+
+def _writer(db_path, profile, pass_ids, seconds, barrier, results):
+    app = _app(db_path, profile)
+    from sqlalchemy.exc import OperationalError
+    from app import db
+    from app.models import Pass, PassUsage
+
+    done = locked = 0
+    with app.app_context():
+        barrier.wait()
+        deadline = time.time() + seconds
+        i = 0
+        while time.time() < deadline:
+            pass_id = pass_ids[i % len(pass_ids)]
+            i += 1
+            try:
+                p = db.session.get(Pass, pass_id)
+                p.used += 1
+                db.session.add(PassUsage(pass_id=pass_id))
+                db.session.commit()
+                done += 1
+            except OperationalError:
+                db.session.rollback()
+                locked += 1
+    results.put(('write', done, locked))
+
+
+def _reader(db_path, profile, seconds, barrier, results):
+    app = _app(db_path, profile)
+    from sqlalchemy import select
+    from sqlalchemy.exc import OperationalError
+    from app import db
+    from app.models import Event, EventRegistration, User
+
+    done = locked = 0
+    start = date.today()
+    end = start + timedelta(days=13)
+    with app.app_context():
+        barrier.wait()
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            try:
+                events = (
+                    Event.query.filter(Event.start_time >= start, Event.start_time <= end)
+                    .order_by(Event.start_time)
+                    .all()
+                )
+                db.session.execute(
+                    select(EventRegistration.event_id, User.username)
+                    .join(User, User.id == EventRegistration.user_id)
+                    .where(EventRegistration.event_id.in_([e.id for e in events]))
+                ).all()
+                db.session.rollback()
+                done += 1
+            except OperationalError:
+                db.session.rollback()
+                locked += 1
+    results.put(('read', done, locked))
+
+
+def run(profile, args, output):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = _app(db_path, profile)
+    from app import db
+    from app.models import Event, EventRegistration, Pass, User
+
+    with app.app_context():
+        users = [
+            User(username=f'member{i}', email=f'member{i}@example.com', password_hash='x')
+            for i in range(200)
+        ]
+        db.session.add_all(users)
+        db.session.flush()
+        passes = [
+            Pass(type='10 alkalom', start_date=date.today(), end_date=date.today(),
+                 total_uses=10 ** 9, used=0, user_id=u.id)
+            for u in users
+        ]
+        db.session.add_all(passes)
+        now = datetime.now()
+        for day in range(14):
+            for hour in (7, 12, 18):
+                start = datetime.combine(now.date(), datetime.min.time()) + timedelta(days=day, hours=hour)
+                event = Event(name='Edzés', start_time=start, end_time=start + timedelta(hours=1),
+                              capacity=20, registered_count=15)
+                db.session.add(event)
+                db.session.flush()
+                db.session.add_all(
+                    EventRegistration(event_id=event.id, user_id=u.id) for u in users[:15]
+                )
+        db.session.commit()
+        pass_ids = [p.id for p in passes]
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.writers + args.readers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_writer, args=(db_path, profile, pass_ids[i::args.writers], args.seconds, barrier, results))
+        for i in range(args.writers)
+    ] + [
+        ctx.Process(target=_reader, args=(db_path, profile, args.seconds, barrier, results))
+        for _ in range(args.readers)
+    ]
+    for p in procs:
+        p.start()
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for _ in procs:
+        kind, done, locked = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += locked
+    for p in procs:
+        p.join()
+    output.put(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    for profile in ('default', 'production'):
+        # ``create_app`` can only run once per process, so every profile is
+        # set up in its own process.
+        output = ctx.Queue()
+        runner = ctx.Process(target=run, args=(profile, args, output))
+        runner.start()
+        totals = output.get()
+        runner.join()
+        print(
+            f"{profile:10} writes {totals['write'][0]:6} ({totals['write'][1]} locked)   "
+            f"reads {totals['read'][0]:6} ({totals['read'][1]} locked)   "
+            f"in {args.seconds:g}s"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Measure how long ``create_app()`` takes against an up-to-date database.
+
+Each sample runs in a fresh interpreter (``create_app`` starts process-wide
+schedulers and can only run once per process) and reports the wall time of
+the ``create_app()`` call and the number of SQL statements it executed.
+The first run initialises the throw-away database and is not counted.
+
+Run from the repository root::
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SAMPLE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+from app import create_app
+started = time.perf_counter()
+create_app()
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'statements': len(statements)}}))
+"""
+
+
+def sample(env):
+    out = subprocess.run(
+        [sys.executable, '-c', SAMPLE.format(root=ROOT)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db')
+    env['OUTBOX_WORKERS'] = '0'
+    env.setdefault('SECRET_KEY', 'benchmark')
+    sample(env)
+    results = [sample(env) for _ in range(args.runs)]
+    times = [r['seconds'] * 1000 for r in results]
+    print(
+        f"create_app(): median {statistics.median(times):.1f} ms, "
+        f"min {min(times):.1f} ms over {args.runs} runs; "
+        f"{results[-1]['statements']} SQL statements"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Fail when the /events calendar issues more statements as events grow.
+
+The script builds a throw-away database with ``--events`` events in the
+two-week window, each with a few registrations, and counts the SQL
+statements of one ``/events`` request with a cold calendar cache and of
+one with a warm cache.  It then doubles the events and counts again.  Both
+counts must stay the same and within ``MAX_STATEMENTS``; a lazy load per
+event or per registration shows up as a count growing with the schedule.
+
+Run from the repository root; the exit status is non-zero on regressions::
+
+    python benchmarks/check_event_queries.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'queries.db')
+os.environ['OUTBOX_WORKERS'] = '0'
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import Event, EventRegistration, User  # noqa: E402
+from app.schedule import grid_cache  # noqa: E402
+
+# Session user, pending series, schedule version and the member's
+# registrations, plus the events themselves when the grid is not cached.
+MAX_STATEMENTS = 5
+
+statements = []
+
+
+def _count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def seed_members(count):
+    member = User(username='member', email='member@example.com')
+    member.set_password('member')
+    users = [member]
+    for i in range(count):
+        user = User(username=f'tag{i}', email=f'tag{i}@example.com')
+        user.password_hash = 'x'
+        users.append(user)
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def seed_events(count, offset, user_ids):
+    start = datetime.combine(date.today(), datetime.min.time())
+    for i in range(offset, offset + count):
+        begins = start + timedelta(days=i % 14, hours=6 + i % 14, minutes=i % 4 * 15)
+        e = Event(
+            name=f'Edzés {i}',
+            start_time=begins,
+            end_time=begins + timedelta(minutes=90),
+            capacity=10,
+        )
+        db.session.add(e)
+        db.session.flush()
+        for user_id in user_ids[i % 3:i % 3 + 4]:
+            db.session.add(EventRegistration(event_id=e.id, user_id=user_id))
+        e.registered_count = 4
+    db.session.commit()
+
+
+def measure(client):
+    counts = []
+    for warm in (False, True):
+        if not warm:
+            grid_cache.clear()
+        statements.clear()
+        event.listen(Engine, 'before_cursor_execute', _count)
+        try:
+            response = client.get('/events')
+        finally:
+            event.remove(Engine, 'before_cursor_execute', _count)
+        if response.status_code != 200:
+            raise SystemExit(f'GET /events returned {response.status_code}')
+        counts.append(len(statements))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=40)
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        user_ids = seed_members(10)
+        seed_events(args.events, 0, user_ids)
+    client = app.test_client()
+    client.post('/login', data={'username': 'member', 'password': 'member'})
+
+    results = {args.events: measure(client)}
+    with app.app_context():
+        seed_events(args.events, args.events, user_ids)
+    results[2 * args.events] = measure(client)
+
+    for events, (cold, warm) in results.items():
+        print(f'{events} events: {cold} statements cold, {warm} warm')
+    counts = [count for pair in results.values() for count in pair]
+    if results[args.events] != results[2 * args.events] or max(counts) > MAX_STATEMENTS:
+        print(f'FAILED: expected the same count for both sizes, at most {MAX_STATEMENTS}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
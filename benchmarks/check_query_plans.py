@@ -0,0 +1,209 @@
+"""Fail when a hot request path makes SQLite scan a whole table.
+
+The script builds a throw-away database with a few hundred members, passes,
+usages and events, drives the member and admin pages through the Flask test
+client (plus the background outbox and reminder queries) and records every
+SQL statement together with its parameters.  Each statement is then run
+through ``EXPLAIN QUERY PLAN``.  A plain ``SCAN <table>`` is reported as a
+regression unless the table is one of the single-row settings tables or the
+statement is a bounded page (``LIMIT``) read in index order, which stops
+after the page is filled.
+
+Run from the repository root; the exit status is non-zero on regressions::
+
+    python benchmarks/check_query_plans.py
+"""
+
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'plans.db')
+os.environ['OUTBOX_WORKERS'] = '0'
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from flask import url_for  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.calendar_feed import feed_token  # noqa: E402
+from app.mailer import OutboxWorkerPool  # noqa: E402
+from app.models import (  # noqa: E402
+    Event,
+    EventRegistration,
+    Pass,
+    PassUsage,
+    User,
+)
+from app.utils import _reminder_chunks, search_users  # noqa: E402
+
+# Tables with a single row where a scan costs nothing.
+SMALL_TABLES = {'email_settings', 'schedule_version', 'schema_version', 'reminder_run'}
+SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+captured = []
+
+
+def _capture(conn, cursor, statement, parameters, context, executemany):
+    if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+        captured.append((statement, parameters))
+
+
+def seed():
+    users = []
+    for i in range(300):
+        user = User(username=f'member{i}', email=f'member{i}@example.com')
+        user.password_hash = 'x'
+        user.weekly_reminder_opt_in = i % 2 == 0
+        users.append(user)
+    admin = User(username='admin', email='admin@example.com', role='admin')
+    admin.set_password('admin')
+    member = users[0]
+    member.set_password('member')
+    db.session.add_all(users + [admin])
+    db.session.flush()
+    for i, user in enumerate(users):
+        p = Pass(
+            type='10 alkalmas' if i % 2 else 'havi',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=30),
+            total_uses=10,
+            used=2,
+            user_id=user.id,
+        )
+        db.session.add(p)
+        db.session.flush()
+        db.session.add_all([PassUsage(pass_id=p.id), PassUsage(pass_id=p.id)])
+    start = datetime.combine(date.today(), datetime.min.time())
+    for day in range(-30, 30):
+        e = Event(
+            name=f'Edzés {day}',
+            start_time=start + timedelta(days=day, hours=18),
+            end_time=start + timedelta(days=day, hours=19),
+            capacity=20,
+        )
+        db.session.add(e)
+    db.session.flush()
+    for e in Event.query.limit(10):
+        for user in users[:5]:
+            db.session.add(EventRegistration(event_id=e.id, user_id=user.id))
+        e.registered_count = 5
+    db.session.commit()
+    return member.id, Event.query.filter(Event.start_time > start).first().id
+
+
+def exercise(app, member_id, event_id):
+    admin = app.test_client()
+    admin.post('/login', data={'username': 'admin', 'password': 'admin'})
+    member = app.test_client()
+    member.post('/login', data={'username': 'member0', 'password': 'member'})
+    with app.app_context():
+        pass_id = Pass.query.filter_by(user_id=member_id).first().id
+        with app.test_request_context():
+            feed_path = url_for(
+                'events.user_calendar', token=feed_token(db.session.get(User, member_id))
+            )
+
+    requests = [
+        (member, 'GET', '/dashboard', None),
+        (member, 'GET', '/events', None),
+        (member, 'GET', f'/events/signup/{event_id}', None),
+        (member, 'GET', f'/events/unregister/{event_id}', None),
+        (member, 'POST', '/toggle_reminder', None),
+        (member, 'GET', feed_path, None),
+        (member, 'GET', '/calendar.ics', None),
+        (member, 'GET', '/api/schedule', None),
+        (member, 'GET', '/api/schedule?since=1', None),
+        (member, 'GET', f'/events/{event_id}/participants', None),
+        (admin, 'GET', '/dashboard', None),
+        (admin, 'GET', '/dashboard?status=active&type=havi&owner=member1', None),
+        (admin, 'GET', '/dashboard?after=100', None),
+        (admin, 'GET', '/users', None),
+        (admin, 'GET', '/users?after=50', None),
+        (admin, 'GET', '/users?q=member2', None),
+        (admin, 'GET', '/users/search?q=mem', None),
+        (admin, 'GET', f'/verify_pass/{pass_id}', None),
+        (admin, 'POST', f'/use_pass/{pass_id}', {'idempotency_key': 'plan-check'}),
+        (admin, 'POST', '/api/checkin', {'pass_id': pass_id}),
+        (admin, 'GET', f'/undo_use/{pass_id}', None),
+        (admin, 'GET', f'/extend_pass/{pass_id}', None),
+        (admin, 'GET', '/admin/events', None),
+        (admin, 'GET', f'/admin/events/{event_id}/edit', None),
+        (admin, 'POST', f'/admin/events/add_user/{event_id}', {'user_id': member_id}),
+        (admin, 'POST', f'/admin/events/remove_user/{event_id}/{member_id}', None),
+        (admin, 'POST', f'/admin/events/checkin/{event_id}', None),
+        (admin, 'GET', '/email_settings', None),
+    ]
+    for client, method, url, data in requests:
+        captured.append((f'-- {method} {url}', None))
+        payload = {'json': data} if url.startswith('/api/') else {'data': data}
+        response = client.open(url, method=method, **payload)
+        if response.status_code >= 400:
+            raise SystemExit(f'{method} {url} returned {response.status_code}')
+
+    with app.app_context():
+        captured.append(('-- outbox claim', None))
+        OutboxWorkerPool(app).claim()
+        captured.append(('-- outbox prune', None))
+        OutboxWorkerPool(app).prune()
+        captured.append(('-- weekly reminder chunks', None))
+        for _ in _reminder_chunks(0, 50):
+            pass
+        captured.append(('-- search_users', None))
+        search_users('member1')
+
+
+def check(connection):
+    tables = set(db.metadata.tables) - SMALL_TABLES
+    problems = []
+    checked = 0
+    label = ''
+    for statement, parameters in captured:
+        if parameters is None:
+            label = statement[3:]
+            continue
+        plan = [row[3] for row in connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters
+        )]
+        checked += 1
+        bounded = ' LIMIT ' in statement.upper() and not any(
+            'TEMP B-TREE' in line for line in plan
+        )
+        for line in plan:
+            match = SCAN.match(line.strip())
+            # Subqueries and CTEs show up as scans of their alias.
+            if not match or match.group(1) not in tables or bounded:
+                continue
+            problems.append((label, line.strip(), ' '.join(statement.split())))
+    return checked, problems
+
+
+def main():
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        member_id, event_id = seed()
+    # Requests reuse an active app context (and the logged-in user cached on
+    # ``g``), so each of them must run outside the one used for seeding.
+    event.listen(Engine, 'before_cursor_execute', _capture)
+    try:
+        exercise(app, member_id, event_id)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _capture)
+    with app.app_context(), db.engine.connect() as connection:
+        checked, problems = check(connection)
+
+    for label, line, statement in problems:
+        print(f'{label}: {line}\n    {statement}\n')
+    print(f'{checked} statements checked, {len(problems)} full table scans')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Multi-process load test of the JSON check-in API.
+
+Creates a throw-away SQLite database with one pass of ``--uses`` uses and
+lets ``--procs`` processes, each logged in as an admin through the Flask
+test client, POST ``/api/checkin`` for it at the same moment.  Every
+idempotency key is sent by two processes to exercise replays.  Exits
+non-zero unless the pass ends up with exactly ``min(uses, keys)`` uses and
+as many ``PassUsage`` rows.
+
+Run from the repository root::
+
+    python benchmarks/load_checkin.py --procs 8 --keys 200 --uses 120
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def _app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from app import create_app
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def _worker(db_path, keys, pass_id, barrier, results):
+    app = _app(db_path)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    outcome = Counter()
+    barrier.wait()
+    started = time.perf_counter()
+    for key in keys:
+        response = client.post(
+            '/api/checkin', json={'pass_id': pass_id}, headers={'Idempotency-Key': key}
+        )
+        body = response.get_json(silent=True) or {}
+        outcome[body.get('status', f'http_{response.status_code}')] += 1
+    outcome['_seconds'] = time.perf_counter() - started
+    results.put(dict(outcome))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--procs', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=200)
+    parser.add_argument('--uses', type=int, default=120)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'checkin.db')
+    app = _app(db_path)
+    from app import db
+    from app.models import Pass, PassUsage, User
+
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com', role='admin')
+        admin.set_password('admin')
+        member = User(username='member', email='member@example.com', password_hash='x')
+        db.session.add_all([admin, member])
+        db.session.flush()
+        p = Pass(
+            type='Load', start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            total_uses=args.uses, used=0, user_id=member.id,
+        )
+        db.session.add(p)
+        db.session.commit()
+        pass_id = p.id
+
+    keys = [f'key-{i}' for i in range(args.keys)]
+    # Every key is sent by two different processes.
+    shares = [
+        keys[i::args.procs] + keys[(i + 1) % args.procs::args.procs]
+        for i in range(args.procs)
+    ]
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.procs)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(db_path, share, pass_id, barrier, results))
+        for share in shares
+    ]
+    for proc in procs:
+        proc.start()
+    totals = Counter()
+    slowest = 0.0
+    for _ in procs:
+        outcome = results.get()
+        slowest = max(slowest, outcome.pop('_seconds'))
+        totals.update(outcome)
+    for proc in procs:
+        proc.join()
+
+    with app.app_context():
+        p = db.session.get(Pass, pass_id)
+        rows = PassUsage.query.filter_by(pass_id=pass_id).count()
+        expected = min(args.uses, args.keys)
+        requests = sum(totals.values())
+        print(f"{requests} requests in {slowest:.2f}s ({requests / slowest:.0f}/s) -> {dict(totals)}")
+        print(f"uses {p.used}/{p.total_uses}, usage rows {rows}, expected {expected}")
+        ok = p.used == expected and rows == expected
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
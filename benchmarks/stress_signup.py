@@ -0,0 +1,122 @@
+"""Multi-process signup burst against a single event.
+
+Creates a throw-away SQLite database with one event of ``--capacity``
+places and ``--users`` members, then lets ``--procs`` processes register
+every member at the same moment (each member is tried by two processes to
+exercise the duplicate check).  Exits non-zero if the event ends up
+overbooked, has duplicate rows or its counter disagrees with the roster.
+
+Run from the repository root::
+
+    python benchmarks/stress_signup.py --procs 8 --users 400 --capacity 25
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def _app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OUTBOX_WORKERS'] = '0'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from app import create_app
+
+    return create_app()
+
+
+def _worker(db_path, user_ids, event_id, barrier, results):
+    app = _app(db_path)
+    from app.registrations import register_for_event
+
+    outcome = Counter()
+    with app.app_context():
+        barrier.wait()
+        for user_id in user_ids:
+            try:
+                outcome[register_for_event(event_id, user_id)] += 1
+            except Exception as exc:  # e.g. "database is locked"
+                from app import db
+
+                db.session.rollback()
+                outcome[type(exc).__name__] += 1
+    results.put(dict(outcome))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--procs', type=int, default=8)
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--capacity', type=int, default=25)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app = _app(db_path)
+    from app import db
+    from app.models import Event, EventRegistration, User
+
+    with app.app_context():
+        users = [
+            User(username=f'member{i}', email=f'member{i}@example.com', password_hash='x')
+            for i in range(args.users)
+        ]
+        start = datetime.now() + timedelta(days=1)
+        event = Event(
+            name='Stress', start_time=start, end_time=start + timedelta(hours=1),
+            capacity=args.capacity,
+        )
+        db.session.add_all(users + [event])
+        db.session.commit()
+        user_ids = [u.id for u in users]
+        event_id = event.id
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.procs)
+    results = ctx.Queue()
+    # Every member is attempted by two different processes.
+    shares = [
+        user_ids[i::args.procs] + user_ids[(i + 1) % args.procs::args.procs]
+        for i in range(args.procs)
+    ]
+    procs = [
+        ctx.Process(target=_worker, args=(db_path, share, event_id, barrier, results))
+        for share in shares
+    ]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    totals = Counter()
+    for _ in procs:
+        totals.update(results.get())
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        event = db.session.get(Event, event_id)
+        rows = EventRegistration.query.filter_by(event_id=event_id).all()
+        distinct = len({r.user_id for r in rows})
+        print(f"attempts: {sum(totals.values())} in {elapsed:.2f}s -> {dict(totals)}")
+        print(
+            f"capacity {event.capacity}, registered_count {event.registered_count}, "
+            f"rows {len(rows)}, distinct users {distinct}"
+        )
+        ok = (
+            len(rows) <= event.capacity
+            and distinct == len(rows)
+            and event.registered_count == len(rows)
+        )
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
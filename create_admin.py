@@ -4,7 +4,6 @@ from app.models import User
 app = create_app()
 
 with app.app_context():
-    db.create_all()
     if not User.query.filter_by(username='admin').first():
         admin = User(username='admin', email='admin@example.com', role='admin')
         admin.set_password('admin123')
@@ -1,13 +1,13 @@
 from datetime import date
 
 from app import create_app
-from app.models import EmailSettings
+from app.settings_cache import get_email_settings
 from app.utils import send_weekly_reminders
 
 app = create_app()
 
 with app.app_context():
-    settings = EmailSettings.query.first()
+    settings = get_email_settings()
     if (
         settings
         and settings.weekly_reminder_enabled